@@ -1,157 +1,164 @@
 import os
-import uvicorn
+import time
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from prompts import *
-from fastapi import FastAPI
-from typing import List
-from fastapi.responses import PlainTextResponse
+import metrics
+from models import ENDPOINTS, get_model, model_name
+from conversation import SessionStore, build_contents
+from upstream import CircuitBreaker, ConcurrencyLimiter, Overloaded, UpstreamClient, estimate_tokens, wait_for_slot
+from bloom import parse_level, parse_numbered_levels
+from cache import ResponseCache, fingerprint, normalize
+from streaming import StoppedEarly, iter_rows, prepend, stop_reason, stopped_marker
+from paper import Paper, build_paper, parse_paper, parse_unit, render_paper, validate_unit
+from prompt_builder import (build_batch_classify_prompt, build_classify_prompt, build_generation_prompt,
+                            build_suggest_prompt, build_unit_prompt, prefix)
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from typing import List, Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-import google.generativeai as genai
+from starlette.routing import Match
 
 load_dotenv()
 
-app = FastAPI()
+router = APIRouter()
 
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-generation_config = {
-    "temperature": 0.9,
-    "top_p": 1,
-    "top_k": 1,
-    "max_output_tokens": 2048,
+# Optional per-client conversations, only used when a request carries a session_id
+session_config = {
+    "max_sessions": int(os.getenv("SESSION_MAX", 1000)),
+    "ttl": int(os.getenv("SESSION_TTL", 1800)),
+    "max_turns": int(os.getenv("SESSION_MAX_TURNS", 10)),
 }
 
-safety_settings = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-]
-
-# Model for classification endpoint
-classify_model = genai.GenerativeModel(
-    model_name="gemini-1.0-pro",
-    generation_config=generation_config,
-    safety_settings=safety_settings,
-)
+classify_sessions = SessionStore(**session_config)
+suggest_sessions = SessionStore(**session_config)
+generate_sessions = SessionStore(**session_config)
 
-classify_convo = classify_model.start_chat(history=[
-    {
-        "role": "user",
-        "parts": ["you are a tool designed to help teachers with setting better exam papers for students that promote understanding and comprehension of the subject matter as compared to simple rote learning. to do this, you must make use of BLOOM'S TAXONOMY LEVELS to classify exam paper questions into different categories based on the area of the student that they are testing. the categories are as follows: REMEMBER - recall facts and basic concepts; UNDERSTAND - explain ideas and concepts; APPLY - use information in new situations; ANALYZE - draw connections among different ideas; EVALUATE - justify a stand or decision; CREATE - produce new or original work. your job is to accept one question of a paper and RETURN THE CORRESPONDING BLOOM LEVEL. return ONLY the bloom level. to start with, send the message: \"Welcome to Bloomify! Send a question you would like me to classify\" and then wait for the user to send a question."]
-    },
-    {
-        "role": "model",
-        "parts": ["Welcome to Bloomify! Send a question you would like me to classify"]
-    },
-    {
-        "role": "user",
-        "parts": ["Define frame buffer"]
-    },
-    {
-        "role": "model",
-        "parts": ["REMEMBER"]
-    },
-    {
-        "role": "user",
-        "parts": ["Differentiate between paging and segmentation"]
-    },
-    {
-        "role": "model",
-        "parts": ["ANALYZE"]
-    },
-    {
-        "role": "user",
-        "parts": ["You need to predict the price of a house based on several features given that describe the house. the predicted price will be a floating point number. will you use linear regression or logistic regression? explain why."]
-    },
-    {
-        "role": "model",
-        "parts": ["ANALYZE"]
-    },
-    {
-        "role": "user",
-        "parts": ["create an architecture for a Convolutional Neural Network that can classify handwritten digits from the MNIST Dataset. Explain how you will process images into a format that the model can interpret."]
-    },
-    {
-        "role": "model",
-        "parts": ["CREATE"]
-    },
-])
-
-# Model for suggestion endpoint
-suggest_model = genai.GenerativeModel(
-    model_name="gemini-1.0-pro",
-    generation_config=generation_config,
-    safety_settings=safety_settings,
+# Bounded model concurrency; requests beyond the queue are shed with a 503.
+# UPSTREAM_RPM / UPSTREAM_TPM pace calls to the API quota (0 = no limit)
+upstream_limiter = ConcurrencyLimiter(
+    max_concurrency=int(os.getenv("MAX_CONCURRENCY", 8)),
+    max_queue=int(os.getenv("MAX_QUEUE", 32)),
+    requests_per_minute=int(os.getenv("UPSTREAM_RPM", 0)),
+    tokens_per_minute=int(os.getenv("UPSTREAM_TPM", 0)),
 )
 
-suggest_convo = suggest_model.start_chat(history=[
-    {
-        "role": "user",
-        "parts": ["you are a tool designed to help teachers with setting better exam papers for students that promote understanding and comprehension of the subject matter as compared to simple rote learning. to do this, you must make use of BLOOM'S TAXONOMY LEVELS. BLOOM'S TAXONOMY LEVELS are as follows: REMEMBER - recall facts and basic concepts; UNDERSTAND - explain ideas and concepts; APPLY - use information in new situations; ANALYZE - draw connections among different ideas; EVALUATE - justify a stand or decision; CREATE - produce new or original work. your job is to accept a question from a user along with a desired level. you will then return THE CURRENT LEVEL of the question along with the modified question that is of the desired level. the user MAY also provide additional information (this is optional for the user) for this task using the tag #additional-information = "" and pass a string containing instructions/information that you may need to transform the question. start the chat by sending \"Welcome to Bloomify. Please provide a question and the desired level you want me to transform it to\" and then wait for the user to respond."]
-    },
-    {
-        "role": "model",
-        "parts": ["Welcome to Bloomify! Please provide a question and the desired level you want me to transform it to"]
-    },
-    {
-        "role": "user",
-        "parts": ["#question=Define Paging. #desired-level=APPLY"]
-    },
-    {
-        "role": "model",
-        "parts": ["Current Level: Remember \n Modified Question: How can paging be used to improve the performance of a virtual memory system?"]
-    },
-])
-
-# Model for generation endpoint
-generate_model = genai.GenerativeModel(
-    model_name="gemini-1.0-pro",
-    generation_config=generation_config,
-    safety_settings=safety_settings,
+# Retries with backoff on 429s and 5xx, a breaker that sheds load while the
+# API keeps failing, and optional hedging once a call is slower than
+# UPSTREAM_HEDGE_AFTER seconds (0 = off)
+upstream_client = UpstreamClient(
+    upstream_limiter,
+    CircuitBreaker(
+        failures=int(os.getenv("BREAKER_FAILURES", 5)),
+        reset_after=float(os.getenv("BREAKER_RESET", 30)),
+    ),
+    retries=int(os.getenv("UPSTREAM_RETRIES", 3)),
+    backoff=float(os.getenv("UPSTREAM_BACKOFF", 0.5)),
+    max_backoff=float(os.getenv("UPSTREAM_MAX_BACKOFF", 8)),
+    hedge_after=float(os.getenv("UPSTREAM_HEDGE_AFTER", 0)),
 )
 
-generate_convo = generate_model.start_chat(history=[])
+# Lower is served first when calls wait for a slot or for quota. Only the
+# short endpoints are hedged, a duplicate /generate/ call is too expensive
+upstream_priority = {"classify": 0, "suggest": 1, "generate": 2}
+hedged_endpoints = {"classify", "suggest"}
 
+# Cache for /classify/ and /suggest/. Set CACHE_PATH to a SQLite file to keep
+# entries across restarts and share them between workers
+@lru_cache(maxsize=None)
+def get_response_cache():
+    return ResponseCache(
+        max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 10000)),
+        ttl=int(os.getenv("CACHE_TTL", 86400)),
+        path=os.getenv("CACHE_PATH"),
+    )
 
-# Model for suggestion endpoint
-suggest_model = genai.GenerativeModel(
-    model_name="gemini-1.0-pro",
-    generation_config=generation_config,
-    safety_settings=safety_settings,
-)
+# What every call to an endpoint starts with: the few-shot examples, plus the
+# instruction when the model cannot take it as a system instruction
+classify_prefix = prefix("classify", classify_history)
+classify_batch_prefix = prefix("classify")
+suggest_prefix = prefix("suggest", suggest_history)
+generate_prefix = prefix("generate", generate_history)
 
-suggest_convo = suggest_model.start_chat(history=[])
+# Upper bound in estimated tokens on the per-request part of each prompt;
+# oversized questions are truncated and oversized syllabi summarised
+prompt_budgets = {
+    "classify": int(os.getenv("PROMPT_BUDGET_CLASSIFY", 512)),
+    "suggest": int(os.getenv("PROMPT_BUDGET_SUGGEST", 768)),
+    "generate": int(os.getenv("PROMPT_BUDGET_GENERATE", 3072)),
+}
 
-# Model for generation endpoint
-generate_model = genai.GenerativeModel(
-    model_name="gemini-1.0-pro",
-    generation_config=generation_config,
-    safety_settings=safety_settings,
+# Keys change whenever the model or the prompts behind an endpoint change
+classify_fingerprint = fingerprint(
+    model_name, classify_instruction, classification_prompt, batch_classification_prompt, classify_history
+)
+suggest_fingerprint = fingerprint(
+    model_name, suggest_instruction, suggestion_prompt, suggestion_grounding, suggest_history
 )
 
-generate_convo = generate_model.start_chat(history=[])
+# Question bank of vetted generated units and LLM-classified questions, at
+# most QUESTION_BANK_MAX_ENTRIES of them (two 4 KB vectors each). Set
+# QUESTION_BANK_PATH to a SQLite file to keep it across restarts
+@lru_cache(maxsize=None)
+def get_question_bank():
+    from question_bank import QuestionBank
+    return QuestionBank(
+        path=os.getenv("QUESTION_BANK_PATH"),
+        max_entries=int(os.getenv("QUESTION_BANK_MAX_ENTRIES", 5000)),
+    )
+
+async def question_bank():
+    # Loading re-embeds every stored question, and lookups are NumPy work that
+    # grows with the bank, so none of it runs on the event loop
+    if get_question_bank.cache_info().currsize:
+        return get_question_bank()
+    return await asyncio.to_thread(get_question_bank)
+
+# Background /generate/jobs: worker pool size, queue bound and how long finished
+# results stay available. Set JOBS_PATH to a SQLite file to survive restarts
+# and share the queue between workers; a job whose worker died is run again
+# once GENERATE_JOB_LEASE seconds pass without word from it
+@lru_cache(maxsize=None)
+def get_job_queue():
+    from jobs import JobQueue
+    return JobQueue(
+        run_generation_job,
+        workers=int(os.getenv("GENERATE_JOB_WORKERS", 2)),
+        max_queued=int(os.getenv("GENERATE_JOB_MAX_QUEUED", 100)),
+        max_finished=int(os.getenv("GENERATE_JOB_MAX_FINISHED", 1000)),
+        ttl=int(os.getenv("GENERATE_JOB_TTL", 3600)),
+        path=os.getenv("JOBS_PATH"),
+        lease=int(os.getenv("GENERATE_JOB_LEASE", 60)),
+    )
+
+# Share of requests whose per-stage timings are logged as JSON, 0 disables tracing
+trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+
+# Number of questions packed into one upstream call by /classify/batch
+classify_batch_size = int(os.getenv("CLASSIFY_BATCH_SIZE", 20))
+
+# /generate/ builds every unit concurrently and regenerates units that fail validation
+generate_unit_attempts = int(os.getenv("GENERATE_UNIT_ATTEMPTS", 3))
+bloom_score_tolerance = float(os.getenv("BLOOM_SCORE_TOLERANCE", 1.0))
 
 class ClassificationInput(BaseModel):
     question: str
+    session_id: Optional[str] = None
 class SuggestionInput(BaseModel):
     question: str
     desired_level: str
+    session_id: Optional[str] = None
 
 class MarkingScheme(BaseModel):
-    marks_per_unit: int
-    main_questions_per_unit: int
-    sub_questions_per_main_question: int
-    marks_per_main_question: int
+    # Counts and marks are divided by when building and filling units
+    marks_per_unit: int = Field(gt=0)
+    main_questions_per_unit: int = Field(gt=0)
+    sub_questions_per_main_question: int = Field(gt=0)
+    marks_per_main_question: int = Field(gt=0)
 
 class Syllabus(BaseModel):
     unit: int
@@ -166,47 +173,448 @@ class GenerationInput(BaseModel):
     year: str
     subject: str
     average_blooms_score: int
+    session_id: Optional[str] = None
+    use_question_bank: bool = True
+
+async def call_model(endpoint, history, sessions, prompt, session_id=None):
+    # The answer's text, and why the model stopped short (None if it did not)
+    with metrics.stage(endpoint, "contents"):
+        contents = build_contents(history, prompt, sessions.get(session_id))
+    chars = sum(len(part) for turn in contents for part in turn["parts"])
+    metrics.prompt_chars.observe(chars, endpoint)
+    tokens = estimate_tokens(chars)
+
+    async def attempt():
+        started = time.perf_counter()
+        try:
+            response = await get_model(endpoint).generate_content_async(contents)
+            return response, response.text, time.perf_counter() - started
+        finally:
+            metrics.record_stage(endpoint, "upstream", time.perf_counter() - started)
+
+    try:
+        response, text, elapsed = await upstream_client.call(
+            endpoint, attempt, upstream_priority[endpoint], tokens, hedge=endpoint in hedged_endpoints
+        )
+    except Overloaded:
+        raise
+    except ValueError:
+        # The SDK refuses .text when the candidate was blocked
+        metrics.upstream_blocked_total.inc(endpoint)
+        raise
+    except Exception as exc:
+        metrics.upstream_errors_total.inc(endpoint, type(exc).__name__)
+        raise
+    stopped = stop_reason(response)
+    if stopped not in (None, "MAX_TOKENS"):
+        # Partial text from a candidate stopped by the filters
+        metrics.upstream_blocked_total.inc(endpoint)
+    # Without streaming the first token arrives with the whole response
+    metrics.upstream_first_token_seconds.observe(elapsed, endpoint)
+    metrics.upstream_seconds.observe(elapsed, endpoint)
+    metrics.response_chars.observe(len(text), endpoint)
+    metrics.record_usage(endpoint, response)
+    upstream_client.settle(tokens, response)
+    sessions.append(session_id, prompt, text)
+    return text, stopped
+
+async def ask(endpoint, history, sessions, prompt, session_id=None):
+    text, _ = await call_model(endpoint, history, sessions, prompt, session_id)
+    return text
+
+async def ask_stream(endpoint, history, sessions, prompt, session_id=None):
+    contents = build_contents(history, prompt, sessions.get(session_id))
+    chars = sum(len(part) for turn in contents for part in turn["parts"])
+    metrics.prompt_chars.observe(chars, endpoint)
+    tokens = estimate_tokens(chars)
+    rows = []
+    last = None
+    stopped = None
+    started = None
+
+    async def open_stream():
+        # Quota errors surface on the first chunk, so it is read here where
+        # the call can still be retried
+        nonlocal started
+        started = time.perf_counter()
+        response = await get_model(endpoint).generate_content_async(contents, stream=True)
+        chunks = response.__aiter__()
+        first = await anext(chunks, None)
+        if first is not None:
+            metrics.upstream_first_token_seconds.observe(time.perf_counter() - started, endpoint)
+        return first, chunks
+
+    async def texts(first, chunks):
+        # Ends at the first chunk that says the model stopped short
+        nonlocal last, stopped
+        if first is None:
+            return
+        async for chunk in prepend(first, chunks):
+            last = chunk
+            stopped = stop_reason(chunk)
+            # A blocked prompt has no candidate to read parts from
+            if (stopped is None or chunk.candidates) and chunk.parts:
+                yield chunk.text
+            if stopped:
+                return
+
+    try:
+        async with upstream_client.stream(endpoint, open_stream, upstream_priority[endpoint], tokens) as (first, chunks):
+            async for row in iter_rows(texts(first, chunks)):
+                rows.append(row)
+                yield row
+    except Overloaded:
+        raise
+    except Exception as exc:
+        metrics.upstream_errors_total.inc(endpoint, type(exc).__name__)
+        raise
+    finally:
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            metrics.record_stage(endpoint, "upstream", elapsed)
+    text = "".join(rows)
+    metrics.upstream_seconds.observe(elapsed, endpoint)
+    metrics.response_chars.observe(len(text), endpoint)
+    if last is not None:
+        metrics.record_usage(endpoint, last)
+        upstream_client.settle(tokens, last)
+    if stopped:
+        if stopped != "MAX_TOKENS":
+            metrics.upstream_blocked_total.inc(endpoint)
+        if not rows:
+            raise StoppedEarly(stopped)
+        # Rows already went out with a 200, so say so in the body
+        yield stopped_marker.format(stopped)
+    sessions.append(session_id, prompt, text)
+
+async def cached_ask(key, endpoint, history, sessions, prompt, session_id=None, valid=None):
+    # Conversations depend on their history, so only stateless requests are
+    # cached, and only answers the model finished and that pass valid(text)
+    if session_id is not None:
+        return await ask(endpoint, history, sessions, prompt, session_id)
+    text = get_response_cache().get(key)
+    if text is None:
+        text, stopped = await call_model(endpoint, history, sessions, prompt)
+        if stopped is None and (valid is None or valid(text)):
+            get_response_cache().set(key, text)
+    return text
+
+def classify_key(question):
+    return fingerprint(classify_fingerprint, normalize(question))
+
+def route_label(request: Request):
+    # Label by route template, never the raw URL, to keep the series bounded
+    for route in router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+async def instrument(request: Request, call_next):
+    # A request counts as in flight until its body is sent, so a streamed
+    # /generate/stream is measured in full rather than up to its headers
+    label = route_label(request)
+    token = metrics.start_trace(label, trace_sample_rate)
+    start = time.perf_counter()
+    metrics.requests_in_flight.inc(label)
+
+    def finish(status):
+        elapsed = time.perf_counter() - start
+        metrics.requests_in_flight.dec(label)
+        metrics.requests_total.inc(label, str(status))
+        metrics.request_seconds.observe(elapsed, label)
+        metrics.finish_trace(token, status, elapsed)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
+    body = response.body_iterator
+
+    async def measured_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish(response.status_code)
 
-@app.get("/hello")
+    response.body_iterator = measured_body()
+    return response
+
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return PlainTextResponse(
+        "Server is busy, please retry shortly", status_code=503, headers={"Retry-After": str(exc.retry_after)}
+    )
+
+async def stopped_early_handler(request: Request, exc: StoppedEarly):
+    return PlainTextResponse(f"The model stopped without an answer ({exc.reason})", status_code=502)
+
+@router.get("/hello")
 async def helloWorld():
     return "hello world"
 
-@app.post("/classify/", response_class=PlainTextResponse)
+@router.get("/cache/stats")
+async def cache_stats():
+    return get_response_cache().stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    metrics.upstream_queue.set(upstream_limiter.in_flight, "running")
+    metrics.upstream_queue.set(upstream_limiter.waiting, "waiting")
+    components = [("cache", get_response_cache), ("upstream", lambda: upstream_client)]
+    # Only report the bank once something has built it
+    if get_question_bank.cache_info().currsize:
+        components.append(("bank", get_question_bank))
+    if get_job_queue.cache_info().currsize:
+        components.append(("jobs", get_job_queue))
+    for component, getter in components:
+        for stat, value in getter().stats().items():
+            metrics.component_stats.set(value, component, stat)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/bank/stats")
+async def bank_stats():
+    return (await question_bank()).stats()
+
+@router.post("/classify/", response_class=PlainTextResponse)
 async def classify_question(input: ClassificationInput):
-    prompt = classification_prompt.format(input.question)
-    response = classify_convo.send_message(prompt)
-    level = response.text
+    prompt = build_classify_prompt(input.question, prompt_budgets["classify"])
+    key = classify_key(input.question)
+    level = await cached_ask(key, "classify", classify_prefix, classify_sessions, prompt, input.session_id, valid=parse_level)
+    if parse_level(level):
+        await asyncio.to_thread((await question_bank()).add, input.question, parse_level(level))
     return level
 
-@app.post("/suggest/", response_class=PlainTextResponse)
+async def classify_chunk(questions):
+    prompt = build_batch_classify_prompt(questions, prompt_budgets["classify"])
+    text = await ask("classify", classify_batch_prefix, classify_sessions, prompt)
+    with metrics.stage("classify", "parse"):
+        levels = parse_numbered_levels(text, len(questions))
+
+    # Only the items the model skipped or mangled pay for a single-question call
+    async def classify_single(question):
+        prompt = build_classify_prompt(question, prompt_budgets["classify"])
+        text = await cached_ask(classify_key(question), "classify", classify_prefix, classify_sessions, prompt, valid=parse_level)
+        return parse_level(text) or text.strip()
+
+    parsed = [(question, level) for question, level in zip(questions, levels) if level is not None]
+    for question, level in parsed:
+        get_response_cache().set(classify_key(question), level)
+    bank = await question_bank()
+
+    def bank_levels():
+        for question, level in parsed:
+            bank.add(question, level)
+
+    await asyncio.to_thread(bank_levels)
+
+    missing = [i for i, level in enumerate(levels) if level is None]
+    retried = await asyncio.gather(*(classify_single(questions[i]) for i in missing))
+    for i, level in zip(missing, retried):
+        levels[i] = level
+    return levels
+
+@router.post("/classify/batch")
+async def classify_batch(inputs: List[ClassificationInput]) -> List[str]:
+    levels = [get_response_cache().get(classify_key(input.question)) for input in inputs]
+    uncached = [i for i, level in enumerate(levels) if level is None]
+    questions = [inputs[i].question for i in uncached]
+    chunks = [questions[i:i + classify_batch_size] for i in range(0, len(questions), classify_batch_size)]
+    results = await asyncio.gather(*(classify_chunk(chunk) for chunk in chunks))
+    for i, level in zip(uncached, (level for chunk in results for level in chunk)):
+        levels[i] = level
+    return levels
+
+@router.post("/suggest/", response_class=PlainTextResponse)
 async def suggest_question(input: SuggestionInput):
-    prompt = suggestion_prompt.format(input.question, input.desired_level)
-    response = suggest_convo.send_message(prompt)
-    transformed_question = response.text
+    # Banked questions close to this one at the desired level ground the rewrite
+    bank = await question_bank()
+    neighbours = await asyncio.to_thread(
+        bank.search, input.question, k=3, level=parse_level(input.desired_level), min_similarity=0.3
+    )
+    related = [entry["text"] for entry, _ in neighbours]
+    prompt = build_suggest_prompt(input.question, input.desired_level, related, prompt_budgets["suggest"])
+    key = fingerprint(suggest_fingerprint, normalize(input.question), normalize(input.desired_level))
+    transformed_question = await cached_ask(key, "suggest", suggest_prefix, suggest_sessions, prompt, input.session_id)
     return transformed_question
 
-@app.post("/generate/", response_class=PlainTextResponse)
+async def generate_unit(input: GenerationInput, syllabus: Syllabus, avoid=(), fill=True):
+    # avoid: questions the unit must not repeat, most important first.
+    # Returns the unit and the validation errors it still has
+    avoid = list(avoid)
+    if input.use_question_bank:
+        # Units the bank can fill on its own never reach the model
+        bank = await question_bank()
+        with metrics.stage("generate", "bank"):
+            unit = await asyncio.to_thread(bank.fill_unit, syllabus.unit, input.subject, syllabus.content, input.marking_scheme, input.average_blooms_score) if fill else None
+            if unit is not None and not validate_unit(unit, input.marking_scheme, input.average_blooms_score, bloom_score_tolerance):
+                return unit, []
+            neighbours = await asyncio.to_thread(bank.search, syllabus.content, k=10, subject=input.subject)
+        avoid.extend(entry["text"] for entry, _ in neighbours if entry["text"] not in avoid)
+    prompt = build_unit_prompt(input, syllabus, avoid, prompt_budgets["generate"])
+    best, best_errors = None, None
+    for attempt in range(generate_unit_attempts):
+        text = await ask("generate", generate_prefix, generate_sessions, prompt)
+        with metrics.stage("generate", "parse"):
+            unit = parse_unit(text, syllabus.unit)
+            errors = validate_unit(unit, input.marking_scheme, input.average_blooms_score, bloom_score_tolerance)
+        if not errors:
+            await asyncio.to_thread((await question_bank()).add_unit, unit, input.subject, syllabus.content)
+            return unit, []
+        if unit.questions and (best_errors is None or len(errors) < len(best_errors)):
+            best, best_errors = unit, errors
+    if best is None:
+        # Not a single answer had rows the parser could read
+        raise HTTPException(status_code=502, detail=f"unit {syllabus.unit}: the model never answered with a question table")
+    # Out of attempts: keep the closest unit rather than failing the whole
+    # paper, and report what is still wrong with it
+    return best, best_errors
+
+async def gather_cancelling(*coroutines):
+    # Like gather, but the first failure cancels the rest instead of leaving
+    # them to spend quota on a paper that is already lost
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def sub_question_texts(unit):
+    return [sub.text for question in unit.questions for sub in question.sub_questions] if unit else []
+
+async def generate_units(input: GenerationInput):
+    # The units, and the validation errors left in them
+    results = await gather_cancelling(*(generate_unit(input, syllabus) for syllabus in input.syllabus))
+    units = [unit for unit, _ in results]
+    errors = [unit_errors for _, unit_errors in results]
+    # Units are generated independently and can come back with the same
+    # questions; a unit repeating an earlier one is regenerated around them
+    from question_bank import near_duplicates
+    seen = []
+    for index, syllabus in enumerate(input.syllabus):
+        unit = units[index]
+        for attempt in range(generate_unit_attempts):
+            with metrics.stage("generate", "dedupe"):
+                repeated = near_duplicates(sub_question_texts(unit), seen)
+            if not repeated:
+                break
+            avoid = repeated + [text for text in seen if text not in repeated]
+            unit, errors[index] = await generate_unit(input, syllabus, avoid, fill=False)
+        units[index] = unit
+        seen.extend(sub_question_texts(unit))
+    return units, [error for unit_errors in errors for error in unit_errors]
+
+@router.post("/generate/", response_class=PlainTextResponse)
 async def generate_questions(input: GenerationInput):
-    prompt = generation_prompt.format(
-        university=input.university,
-        degree=input.degree,
-        branch=input.branch,
-        year=input.year,
-        subject=input.subject,
-        syllabus=input.syllabus,
-        total_marks=input.marking_scheme.marks_per_unit * len(input.syllabus),
-        marks_per_main_question=input.marking_scheme.marks_per_main_question,
-        marks_per_unit = input.marking_scheme.marks_per_unit,
-        main_questions_per_unit=input.marking_scheme.main_questions_per_unit,
-        sub_questions_per_main_question=input.marking_scheme.sub_questions_per_main_question,
-        average_blooms_score = input.average_blooms_score,
+    # A conversation refines one paper across turns, so it stays a single call
+    if input.session_id is not None:
+        prompt = build_generation_prompt(input, prompt_budgets["generate"])
+        return await ask("generate", generate_prefix, generate_sessions, prompt, input.session_id)
+    units, errors = await generate_units(input)
+    generated_question = render_paper(units, input.university, input.degree, input.year, input.branch, input.subject)
+    # Units that never passed validation are still sent; the header says why
+    headers = {"X-Validation-Errors": "; ".join(errors).encode("ascii", "replace").decode()} if errors else None
+    return PlainTextResponse(generated_question, headers=headers)
+
+@router.post("/generate/json")
+async def generate_questions_json(input: GenerationInput) -> Paper:
+    errors = []
+    if input.session_id is not None:
+        prompt = build_generation_prompt(input, prompt_budgets["generate"])
+        text = await ask("generate", generate_prefix, generate_sessions, prompt, input.session_id)
+        units = parse_paper(text)
+    else:
+        units, errors = await generate_units(input)
+    paper = build_paper(units, input.university, input.degree, input.year, input.branch, input.subject)
+    paper.validation_errors = errors
+    return paper
+
+async def run_generation_job(payload):
+    # Nobody is waiting on the connection, so a busy upstream is waited out
+    # instead of failing the job; the job worker count bounds these waiters
+    wait_for_slot.set(True)
+    input = GenerationInput(**payload)
+    units, errors = await generate_units(input)
+    paper = build_paper(units, input.university, input.degree, input.year, input.branch, input.subject)
+    paper.validation_errors = errors
+    markdown = render_paper(units, input.university, input.degree, input.year, input.branch, input.subject)
+    return {"markdown": markdown, "paper": paper.model_dump()}
+
+@router.post("/generate/jobs", status_code=202)
+async def submit_generation_job(input: GenerationInput):
+    # Jobs never continue a conversation, so the session is not part of the payload
+    job = await get_job_queue().submit(input.model_dump(exclude={"session_id"}))
+    return {"id": job.id, "status": job.status}
+
+@router.get("/generate/jobs/{job_id}")
+async def get_generation_job(job_id: str, wait: float = 0):
+    # wait > 0 long-polls until the job finishes or the timeout passes
+    queue = get_job_queue()
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if wait > 0:
+        job = await queue.wait(job, min(wait, 60))
+    return job.describe()
+
+@router.post("/generate/stream")
+async def generate_questions_stream(input: GenerationInput):
+    prompt = build_generation_prompt(input, prompt_budgets["generate"])
+    rows = ask_stream("generate", generate_prefix, generate_sessions, prompt, input.session_id)
+    # Wait for the first row here so a full queue or an upstream failure still
+    # gets a proper status code instead of a truncated 200
+    first = await anext(rows, "")
+    return StreamingResponse(
+        prepend(first, rows), media_type="text/plain; charset=utf-8", headers={"X-Accel-Buffering": "no"}
     )
-    response = generate_convo.send_message(prompt)
-    generated_question = response.text
-    return generated_question
 
-# Set host and port based on environment variables
-host = os.getenv("HOST", "127.0.0.1")  # Default to 127.0.0.1 if HOST variable is not set
-port = int(os.getenv("PORT", 5000))     # Default to port 5000 if PORT variable is not set
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are otherwise built on first use; PRELOAD_MODELS=1 pays that
+    # cost at startup instead of on the first request
+    if os.getenv("PRELOAD_MODELS") == "1":
+        for endpoint in ENDPOINTS:
+            get_model(endpoint)
+        get_response_cache()
+    # Loaded here rather than inside the first request that needs it
+    await question_bank()
+    get_job_queue().start()
+    yield
+    await get_job_queue().stop()
+    # Cache and bank writes are committed in the background; finish them
+    for getter in (get_response_cache, get_question_bank):
+        if getter.cache_info().currsize:
+            await asyncio.to_thread(getter().flush)
+
+def create_app():
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_exception_handler(Overloaded, overloaded_handler)
+    app.add_exception_handler(StoppedEarly, stopped_early_handler)
+    app.middleware("http")(instrument)
+    if trace_sample_rate and not metrics.logger.handlers:
+        metrics.logger.setLevel(logging.INFO)
+        metrics.logger.addHandler(logging.StreamHandler())
+    app.include_router(router)
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Set host and port based on environment variables
+    host = os.getenv("HOST", "127.0.0.1")  # Default to 127.0.0.1 if HOST variable is not set
+    port = int(os.getenv("PORT", 5000))     # Default to port 5000 if PORT variable is not set
 
-uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    uvicorn.run(app, host=host, port=port)
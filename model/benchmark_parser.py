@@ -0,0 +1,58 @@
+import os
+import time
+import argparse
+from paper import build_paper, parse_paper, render_paper
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "example_paper.md")
+
+# The worked example that used to sit in generation_prompt is a realistic,
+# padded two-unit paper; repeat it with renumbered units to build papers of any size
+with open(EXAMPLE_PATH, encoding="utf-8") as file:
+    EXAMPLE_ROWS = [
+        line for line in file.read().splitlines()
+        if line.startswith("|") and "Sub-question" not in line and not line.startswith("|---")
+    ]
+
+def make_paper(units):
+    rows = [
+        "**University - Degree**",
+        "**Year - Branch**",
+        "**Subject - Subject**",
+        "",
+        "| Unit | Question | Marks | Sub-question | Marks (per sub-question) | Taxonomy Level | Question Type |",
+        "|------|----------|-------|--------------|--------------------------|----------------|---------------|",
+    ]
+    for unit in range(1, units + 1, 2):
+        for row in EXAMPLE_ROWS:
+            rows.append(row.replace("| Unit 1 |", f"| Unit {unit} |").replace("| Unit 2 |", f"| Unit {unit + 1} |"))
+    return "\n".join(rows)
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    details = ("University", "Degree", "Year", "Branch", "Subject")
+    print(f"{'units':>6} {'rows':>6} {'markdown':>10} {'json':>10} {'parse':>10} {'build':>10} {'round trip':>11}")
+    for units in (2, 10, 50, 200):
+        text = make_paper(units)
+        parse_time, parsed = best_of(args.repeat, parse_paper, text)
+        build_time, paper = best_of(args.repeat, build_paper, parsed, *details)
+        document = paper.model_dump_json()
+        round_trip = parse_paper(render_paper(paper.units, *details))
+        same = [unit.questions for unit in round_trip] == [unit.questions for unit in parsed]
+        print(f"{units:>6} {text.count(chr(10)) + 1:>6} {len(text):>10} {len(document):>10} "
+              f"{parse_time * 1000:>8.2f}ms {build_time * 1000:>8.2f}ms {str(same):>11}")
+    print(f"bloom score {paper.bloom_score}, total marks {paper.total_marks}, per level {paper.marks_per_level}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import json
+import argparse
+from statistics import mean
+from app import GenerationInput, prompt_budgets
+from bloom import BLOOM_LEVELS, parse_level
+from conversation import build_contents
+from models import system_instruction_supported
+from paper import bloom_score, parse_unit, validate_unit
+from prompts import *
+from prompt_builder import (build_classify_prompt, build_generation_prompt, build_suggest_prompt, build_unit_prompt,
+                            example_unit, prefix, summarize_syllabus)
+from upstream import estimate_tokens
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_PATH = os.path.join(HERE, "data", "prompt_fixtures.json")
+# The prompts as they were before compaction, kept as data so the comparison
+# does not depend on the git history
+BASELINE_PATH = os.path.join(HERE, "data", "baseline_prompts.json")
+
+def baseline_prompts(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def counter(count_tokens):
+    # chars / 4 by default; with --count-tokens the API's own count (needs GOOGLE_API_KEY)
+    if not count_tokens:
+        def count(contents, endpoint=None):
+            chars = sum(len(part) for turn in contents for part in turn["parts"])
+            if endpoint and system_instruction_supported:
+                # The system instruction is billed on every call like the rest of the input
+                chars += len(system_instructions[endpoint])
+            return estimate_tokens(chars)
+        return count
+    from models import configure, get_model, model_name
+    plain = configure().GenerativeModel(model_name)
+    return lambda contents, endpoint=None: (get_model(endpoint) if endpoint else plain).count_tokens(contents).total_tokens
+
+def old_unit_prompt(old, input, syllabus):
+    scheme = input.marking_scheme
+    return old["unit_generation_prompt"].format(
+        university=input.university, degree=input.degree, year=input.year, branch=input.branch,
+        subject=input.subject, unit=syllabus.unit, content=syllabus.content, marks_per_unit=scheme.marks_per_unit,
+        main_questions_per_unit=scheme.main_questions_per_unit, marks_per_main_question=scheme.marks_per_main_question,
+        sub_questions_per_main_question=scheme.sub_questions_per_main_question,
+        average_blooms_score=input.average_blooms_score, avoid="",
+    )
+
+def old_paper_prompt(old, input):
+    # As it was built: the syllabus went in as the repr of the pydantic list
+    scheme = input.marking_scheme
+    return old["generation_prompt"].format(
+        university=input.university, degree=input.degree, branch=input.branch, year=input.year,
+        subject=input.subject, syllabus=input.syllabus, total_marks=scheme.marks_per_unit * len(input.syllabus),
+        marks_per_main_question=scheme.marks_per_main_question, marks_per_unit=scheme.marks_per_unit,
+        main_questions_per_unit=scheme.main_questions_per_unit,
+        sub_questions_per_main_question=scheme.sub_questions_per_main_question,
+        average_blooms_score=input.average_blooms_score,
+    )
+
+def labelled(history):
+    # The (question, level) pairs a few-shot history teaches
+    turns = list(history)
+    return [(user["parts"][0], model["parts"][0]) for user, model in zip(turns, turns[1:])
+            if user["role"] == "user" and model["role"] == "model" and model["parts"][0] in BLOOM_LEVELS]
+
+def cases(old, fixtures, questions):
+    # (endpoint, label, contents before, contents after) for every fixture call
+    for question, _ in questions:
+        yield ("classify", "classify",
+               build_contents(old["classify_history"], old["classification_prompt"].format(question)),
+               build_contents(prefix("classify", classify_history), build_classify_prompt(question, prompt_budgets["classify"])))
+    for item in fixtures["suggest"]:
+        question, level = item["question"], item["desired_level"]
+        yield ("suggest", "suggest",
+               build_contents(old["suggest_history"], old["suggestion_prompt"].format(question, level, "")),
+               build_contents(prefix("suggest", suggest_history),
+                              build_suggest_prompt(question, level, (), prompt_budgets["suggest"])))
+    for input in fixtures["generate"]:
+        for syllabus in input.syllabus:
+            yield ("generate", "generate (unit)",
+                   build_contents(old["generate_history"], old_unit_prompt(old, input, syllabus)),
+                   build_contents(prefix("generate", generate_history),
+                                  build_unit_prompt(input, syllabus, (), prompt_budgets["generate"])))
+        yield ("generate", "generate (paper)",
+               build_contents(old["generate_history"], old_paper_prompt(old, input)),
+               build_contents(prefix("generate", generate_history), build_generation_prompt(input, prompt_budgets["generate"])))
+
+def report_tokens(rows, count):
+    print(f"{'call':<18} {'fixtures':>8} {'before':>8} {'after':>8} {'saved':>7}")
+    labels = list(dict.fromkeys(label for _, label, _, _ in rows))
+    for label in labels:
+        group = [row for row in rows if row[1] == label]
+        before = mean(count(old) for _, _, old, _ in group)
+        after = mean(count(new, endpoint) for endpoint, _, _, new in group)
+        print(f"{label:<18} {len(group):>8} {before:>8.0f} {after:>8.0f} {1 - after / before:>7.0%}")
+
+def example_matches(unit, scheme):
+    # Questions whose sub-question count and marks follow the requested scheme
+    return sum(
+        len(question.sub_questions) == scheme.sub_questions_per_main_question
+        and sum(sub.marks for sub in question.sub_questions) == scheme.marks_per_main_question
+        for question in unit.questions
+    ), len(unit.questions)
+
+def report_prompt_checks(old, fixtures, tight_budget):
+    # These look at the prompts themselves. Whether the model answers as well
+    # with them is only measured by --llm
+    print("\nprompt checks (not output quality):")
+    same = labelled(old["classify_history"]) == labelled(classify_history)
+    print(f"classify few-shot examples unchanged: {same}")
+    for input in fixtures["generate"]:
+        scheme = input.marking_scheme
+        before = example_matches(parse_unit(old_unit_prompt(old, input, input.syllabus[0]), 1), scheme)
+        after = example_matches(example_unit(scheme, 1), scheme)
+        print(f"{input.subject}: example questions matching the requested scheme "
+              f"before {before[0]}/{before[1]}, after {after[0]}/{after[1]}")
+    longest = max((syllabus for input in fixtures["generate"] for syllabus in input.syllabus),
+                  key=lambda syllabus: len(syllabus.content))
+    summary = summarize_syllabus(longest.content, tight_budget)
+    print(f"longest syllabus ({estimate_tokens(len(longest.content))} tokens) summarised into {tight_budget}: "
+          f"{estimate_tokens(len(summary))} tokens\n  {summary}")
+
+def report_llm_quality(old, fixtures, questions):
+    # Same fixtures through the model with the old and the new prompts
+    from models import configure, generation_config, get_model, model_name, safety_settings
+    plain = configure().GenerativeModel(model_name, generation_config=generation_config, safety_settings=safety_settings)
+    rows = list(cases(old, fixtures, questions))
+    classify = [row for row in rows if row[1] == "classify"]
+    for name, model, index in (("before", plain, 2), ("after", get_model("classify"), 3)):
+        levels = [parse_level(model.generate_content(row[index]).text) for row in classify]
+        correct = sum(level == expected for level, (_, expected) in zip(levels, questions))
+        print(f"classify accuracy {name}: {correct / len(questions):.1%}")
+    units = [(input, syllabus) for input in fixtures["generate"] for syllabus in input.syllabus]
+    generate = [row for row in rows if row[1] == "generate (unit)"]
+    for name, model, index in (("before", plain, 2), ("after", get_model("generate"), 3)):
+        valid, drift = 0, []
+        for (input, syllabus), row in zip(units, generate):
+            unit = parse_unit(model.generate_content(row[index]).text, syllabus.unit)
+            valid += not validate_unit(unit, input.marking_scheme, input.average_blooms_score, 1.0)
+            drift.append(abs(bloom_score([sub for q in unit.questions for sub in q.sub_questions])
+                             - input.average_blooms_score))
+        print(f"generate {name}: {valid}/{len(units)} units valid, mean Bloom score drift {mean(drift):.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="JSON file of the prompts to compare against")
+    parser.add_argument("--tight-budget", type=int, default=80)
+    parser.add_argument("--count-tokens", action="store_true", help="count with the API instead of estimating")
+    parser.add_argument("--llm", action="store_true", help="compare outputs of the old and new prompts")
+    args = parser.parse_args()
+
+    old = baseline_prompts(args.baseline)
+    with open(FIXTURES_PATH, encoding="utf-8") as file:
+        fixtures = json.load(file)
+    fixtures["generate"] = [GenerationInput(**item) for item in fixtures["generate"]]
+    # Labelled questions, a few per level, none of them a few-shot example
+    questions = [(item["question"], item["level"]) for item in fixtures["classify"]]
+    print(f"baseline prompts from {os.path.relpath(args.baseline, HERE)}, system instruction "
+          f"{'supported' if system_instruction_supported else 'sent as the first turn'}")
+    report_tokens(list(cases(old, fixtures, questions)), counter(args.count_tokens))
+    report_prompt_checks(old, fixtures, args.tight_budget)
+    if args.llm:
+        report_llm_quality(old, fixtures, questions)
+    else:
+        print("\noutput quality not measured: run with --llm (needs GOOGLE_API_KEY) to compare the model's "
+              "answers to the old and new prompts")
+
+if __name__ == "__main__":
+    main()
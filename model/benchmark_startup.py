@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+# Each run is a fresh interpreter, so this is a true cold import. The child
+# also reports whether anything heavy or networked slipped back in at import.
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "sdk_imported": "google.generativeai" in sys.modules,
+    "uvicorn_imported": "uvicorn" in sys.modules,
+}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit non-zero if the median import time exceeds this")
+    args = parser.parse_args()
+
+    # No API key on purpose: importing the app must not need one
+    env = {key: value for key, value in os.environ.items() if key != "GOOGLE_API_KEY"}
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=here, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    seconds = [result["seconds"] for result in results]
+    print(f"import app: median {median(seconds) * 1000:.0f} ms, "
+          f"min {min(seconds) * 1000:.0f} ms, max {max(seconds) * 1000:.0f} ms over {args.runs} runs")
+    print(f"google.generativeai imported: {results[-1]['sdk_imported']}")
+    print(f"uvicorn imported: {results[-1]['uvicorn_imported']}")
+
+    failed = results[-1]["sdk_imported"] or results[-1]["uvicorn_imported"]
+    if args.max_seconds is not None and median(seconds) > args.max_seconds:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
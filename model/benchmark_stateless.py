@@ -0,0 +1,70 @@
+import json
+import time
+import argparse
+from prompts import classify_history, classification_prompt
+from conversation import SessionStore, build_contents
+
+# Stubbed model: serializes the request like the SDK would and echoes a level,
+# so the measured cost grows with the payload just as the real round trip does.
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+class StubModel:
+    def generate_content(self, contents):
+        payload = json.dumps(contents)
+        return StubResponse("REMEMBER"), len(payload)
+
+class StubChat:
+    # Mirrors the old process-global start_chat/send_message behaviour
+    def __init__(self, history):
+        self.history = list(history)
+
+    def send_message(self, prompt):
+        self.history.append({"role": "user", "parts": [prompt]})
+        response, size = StubModel().generate_content(self.history)
+        self.history.append({"role": "model", "parts": [response.text]})
+        return response, size
+
+def run(label, call, requests, window):
+    latencies, sizes = [], []
+    for i in range(requests):
+        prompt = classification_prompt.format(f"Define paging ({i})")
+        start = time.perf_counter()
+        size = call(prompt, i)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(size)
+
+    first = slice(0, window)
+    last = slice(requests - window, requests)
+    print(f"{label}: {requests} requests")
+    for name, part in (("first", first), (" last", last)):
+        avg_latency = sum(latencies[part]) / window * 1e6
+        avg_size = sum(sizes[part]) / window
+        print(f"  {name} {window}: {avg_latency:8.1f} us/request, {avg_size:10.0f} bytes/request")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--legacy-requests", type=int, default=1000)
+    parser.add_argument("--window", type=int, default=500)
+    args = parser.parse_args()
+
+    model = StubModel()
+    run("stateless", lambda prompt, i: model.generate_content(build_contents(classify_history, prompt))[1],
+        args.requests, args.window)
+
+    sessions = SessionStore(max_sessions=100, max_turns=10)
+    def with_session(prompt, i):
+        session_id = f"client-{i % 50}"
+        response, size = model.generate_content(build_contents(classify_history, prompt, sessions.get(session_id)))
+        sessions.append(session_id, prompt, response.text)
+        return size
+    run("sessions (50 clients, 10 turns each)", with_session, args.requests, args.window)
+
+    chat = StubChat(classify_history)
+    run("legacy shared chat", lambda prompt, i: chat.send_message(prompt)[1],
+        args.legacy_requests, min(args.window, args.legacy_requests // 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import time
+import asyncio
+import argparse
+from streaming import iter_rows
+
+ROW = "|        |                      |       | 1.2 Describe the Topology of neural network architecture. | 4 | Apply | Descriptive |\n"
+
+# Fake streaming model: emits a paper a few characters at a time, with a
+# fixed first-token latency and a per-chunk delay
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+class FakeStreamingModel:
+    def __init__(self, rows, first_token, per_chunk, chunk_size):
+        self.text = ROW * rows
+        self.first_token = first_token
+        self.per_chunk = per_chunk
+        self.chunk_size = chunk_size
+
+    async def generate_content_async(self, contents, stream=False):
+        async def chunks():
+            await asyncio.sleep(self.first_token)
+            for i in range(0, len(self.text), self.chunk_size):
+                yield FakeChunk(self.text[i:i + self.chunk_size])
+                await asyncio.sleep(self.per_chunk)
+        if stream:
+            return chunks()
+        text = "".join([chunk.text async for chunk in chunks()])
+        return FakeChunk(text)
+
+async def measure(model):
+    start = time.perf_counter()
+    await model.generate_content_async([])
+    buffered = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = await model.generate_content_async([], stream=True)
+    first_row, rows = None, 0
+    async for row in iter_rows(chunk.text async for chunk in response if chunk.parts):
+        if first_row is None:
+            first_row = time.perf_counter() - start
+        rows += row.count("\n")
+    streamed = time.perf_counter() - start
+    return buffered, first_row, streamed, rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=30)
+    parser.add_argument("--first-token", type=float, default=0.5)
+    parser.add_argument("--per-chunk", type=float, default=0.01)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    args = parser.parse_args()
+
+    model = FakeStreamingModel(args.rows, args.first_token, args.per_chunk, args.chunk_size)
+    buffered, first_row, streamed, rows = asyncio.run(measure(model))
+    print(f"buffered /generate/:  first byte after {buffered:6.2f} s")
+    print(f"streamed /generate/stream: first row after {first_row:6.2f} s, "
+          f"{rows} rows done after {streamed:6.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import deque
+from upstream import CircuitBreaker, ConcurrencyLimiter, Overloaded, UpstreamClient
+
+# Local fake of the model API over HTTP. It enforces a requests-per-minute
+# quota with 429s like the real API (counted over 10 seconds to keep runs
+# short), and injects random 429s, outages and slow tail responses. The SDK's async client only speaks gRPC, so the
+# harness drives the upstream client through the small HttpModel below.
+class FakeServer:
+    def __init__(self, latency, tail_latency, tail_rate, quota_rpm, error_rate):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.quota_rpm = quota_rpm
+        self.error_rate = error_rate
+        self.outage = False
+        self.calls = 0
+        self.rejected = 0
+        self._window = deque()
+
+    def _over_quota(self):
+        now = time.monotonic()
+        while self._window and self._window[0] < now - 10:
+            self._window.popleft()
+        if len(self._window) >= self.quota_rpm / 6:
+            return True
+        self._window.append(now)
+        return False
+
+    async def handle(self, reader, writer):
+        try:
+            headers = (await reader.readuntil(b"\r\n\r\n")).decode().lower()
+            length = int(headers.split("content-length:")[1].split("\r\n")[0])
+            request = json.loads(await reader.readexactly(length))
+        except asyncio.IncompleteReadError:
+            # A cancelled hedge can hang up before sending its request
+            writer.close()
+            return
+        self.calls += 1
+        if self.outage:
+            status, body = 503, {"error": "unavailable"}
+        elif self._over_quota() or random.random() < self.error_rate:
+            self.rejected += 1
+            status, body = 429, {"error": "quota exceeded"}
+        else:
+            slow = random.random() < self.tail_rate
+            await asyncio.sleep((self.tail_latency if slow else self.latency) * request["scale"])
+            status, body = 200, {"text": "REMEMBER", "tokens": request["tokens"] + 1}
+        payload = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status} X\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode())
+        writer.write(payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # Or before reading the answer
+            pass
+        writer.close()
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+class Usage:
+    def __init__(self, total):
+        self.total_token_count = total
+
+class FakeResponse:
+    def __init__(self, text, tokens):
+        self.text = text
+        self.usage_metadata = Usage(tokens)
+
+class HttpModel:
+    def __init__(self, port):
+        self.port = port
+
+    async def generate_content_async(self, contents, scale=1, tokens=100):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        try:
+            body = json.dumps({"contents": contents, "scale": scale, "tokens": tokens}).encode()
+            writer.write(b"POST /generate HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            await reader.readuntil(b"\r\n\r\n")
+            payload = json.loads(await reader.read())
+        finally:
+            writer.close()
+        if status != 200:
+            raise UpstreamError(status)
+        return FakeResponse(payload["text"], payload["tokens"])
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else float("nan")
+
+async def run(client, model, calls, clients, hedge=False, lanes=True):
+    # calls: list of (endpoint, priority, scale); returns latencies per endpoint and failures
+    queue = deque(calls)
+    latencies = {}
+    failures = {}
+
+    async def worker():
+        while queue:
+            endpoint, priority, scale = queue.popleft()
+
+            async def attempt():
+                return await model.generate_content_async([], scale=scale)
+
+            start = time.perf_counter()
+            try:
+                await client.call(endpoint, attempt, priority if lanes else 0, 100, hedge=hedge)
+                latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            except (Overloaded, UpstreamError) as exc:
+                failures[type(exc).__name__] = failures.get(type(exc).__name__, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies, failures
+
+def report(name, latencies, failures, server):
+    for endpoint, values in sorted(latencies.items()):
+        print(f"{name:<28} {endpoint:<9} {len(values):>4} ok {percentile(values, 0.5) * 1000:>7.0f} "
+              f"{percentile(values, 0.99) * 1000:>7.0f}  failed {failures or '-'}  upstream calls {server.calls}")
+
+def client_for(limiter, retries, hedge_after=0.0, breaker=None):
+    return UpstreamClient(limiter, breaker or CircuitBreaker(failures=10**9), retries=retries,
+                          backoff=0.05, max_backoff=1.0, hedge_after=hedge_after)
+
+async def main(args):
+    server = FakeServer(args.latency, args.tail_latency, args.tail_rate, args.quota_rpm, args.error_rate)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    model = HttpModel(listener.sockets[0].getsockname()[1])
+    classify = [("classify", 0, 1)] * args.requests
+    print(f"fake API: {args.latency * 1000:.0f} ms, {args.tail_rate:.0%} of calls take "
+          f"{args.tail_latency * 1000:.0f} ms, {args.error_rate:.0%} random 429s, quota {args.quota_rpm} rpm")
+    print(f"{'scenario':<28} {'endpoint':<9} {'count':>7} {'p50 ms':>7} {'p99 ms':>7}")
+
+    async def scenario(name, client, calls, clients, **kwargs):
+        server.calls = 0
+        server._window.clear()
+        latencies, failures = await run(client, model, calls, clients, **kwargs)
+        report(name, latencies, failures, server)
+
+    # 429s straight through to the caller, as before
+    await scenario("no quota, no retries", client_for(ConcurrencyLimiter(32, 10**6), 0), classify, args.clients)
+    # Paced to the quota, random 429s retried
+    limiter = ConcurrencyLimiter(32, 10**6, requests_per_minute=args.quota_rpm)
+    await scenario("quota + retries", client_for(limiter, 3), classify, args.clients)
+
+    # With the quota out of the way the slow tail dominates p99; hedging
+    # duplicates the calls stuck in it
+    server.quota_rpm = 10**9
+    await scenario("retries", client_for(ConcurrencyLimiter(32, 10**6), 3), classify, args.clients)
+    await scenario("retries + hedging", client_for(ConcurrencyLimiter(32, 10**6), 3, args.hedge_after), classify,
+                   args.clients, hedge=True)
+
+    # A backlog of slow /generate/ calls ahead of /classify/
+    mixed = [("generate", 2, 10)] * (args.requests // 4) + [("classify", 0, 1)] * args.requests
+    for lanes in (False, True):
+        await scenario(f"mixed, lanes {'on' if lanes else 'off'}", client_for(ConcurrencyLimiter(8, 10**6), 3),
+                       mixed, args.clients, lanes=lanes)
+
+    # Full outage: the breaker stops sending calls after a few failures
+    server.outage = True
+    for failures in (10**9, 5):
+        breaker = CircuitBreaker(failures=failures, reset_after=30)
+        server.calls = 0
+        _, failed = await run(client_for(ConcurrencyLimiter(32, 10**6), 3, breaker=breaker), model, classify,
+                              args.clients)
+        label = "breaker off" if failures == 10**9 else f"breaker after {failures}"
+        print(f"{'outage, ' + label:<28} upstream calls {server.calls} for {args.requests} requests, failed {failed}")
+    listener.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--tail-latency", type=float, default=0.5)
+    parser.add_argument("--tail-rate", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--quota-rpm", type=int, default=1200)
+    parser.add_argument("--hedge-after", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
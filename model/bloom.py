@@ -0,0 +1,49 @@
+import re
+
+BLOOM_LEVELS = ("REMEMBER", "UNDERSTAND", "APPLY", "ANALYZE", "EVALUATE", "CREATE")
+
+# Spellings the model sometimes returns instead of the canonical level names
+LEVEL_ALIASES = {
+    "ANALYSE": "ANALYZE",
+    "KNOWLEDGE": "REMEMBER",
+    "COMPREHENSION": "UNDERSTAND",
+    "APPLICATION": "APPLY",
+    "ANALYSIS": "ANALYZE",
+    "EVALUATION": "EVALUATE",
+    "SYNTHESIS": "CREATE",
+}
+
+_word = re.compile(r"[A-Za-z]+")
+_numbered = re.compile(r"^\s*\**\s*(\d+)\s*[\.\):\-]\s*(.*)$")
+
+
+def parse_level(text):
+    # First word of the text that names a Bloom level, or None
+    for word in _word.findall(text or ""):
+        word = word.upper()
+        word = LEVEL_ALIASES.get(word, word)
+        if word in BLOOM_LEVELS:
+            return word
+    return None
+
+
+def parse_numbered_levels(text, count):
+    # Levels for items 1..count of a numbered list; unparsed items are None
+    levels = [None] * count
+    for line in (text or "").splitlines():
+        match = _numbered.match(line)
+        if not match:
+            continue
+        index = int(match.group(1)) - 1
+        if 0 <= index < count and levels[index] is None:
+            levels[index] = _only_level(match.group(2))
+    return levels
+
+
+def _only_level(text):
+    # The level when the text is nothing but one, give or take markdown and a
+    # full stop. Anything longer may name other levels in passing, as in
+    # "Create a CNN - ANALYZE", so it is left for a single-question call
+    word = text.strip().strip("*_`.").strip().upper()
+    word = LEVEL_ALIASES.get(word, word)
+    return word if word in BLOOM_LEVELS else None
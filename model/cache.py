@@ -0,0 +1,149 @@
+import re
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def normalize(text):
+    # Fold case, punctuation and whitespace so trivially different questions share a key
+    return " ".join(_punctuation.sub(" ", text.lower()).split())
+
+
+def fingerprint(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BackgroundWriter:
+    """Runs SQLite writes on a daemon thread with its own connection.
+
+    Callers on the event loop only enqueue; the thread commits whatever has
+    queued up in one transaction, so a burst of writes costs one commit."""
+
+    def __init__(self, path):
+        self.path = path
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def execute(self, sql, params=()):
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        # Blocks until everything queued so far is committed
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def _run(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            flushed = []
+            try:
+                for sql, params in batch:
+                    if sql is None:
+                        flushed.append(params)
+                    else:
+                        db.execute(sql, params)
+                        self.written += 1
+                db.commit()
+            except sqlite3.Error:
+                # A lost cache or bank write is not worth stopping the writer for
+                db.rollback()
+            for done in flushed:
+                done.set()
+
+
+class ResponseCache:
+    """In-memory LRU with TTL, optionally backed by SQLite so entries survive
+    restarts and are shared between workers on the same host."""
+
+    def __init__(self, max_entries=10000, ttl=86400, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._db.commit()
+            self._writer = BackgroundWriter(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[1], row[0])
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, (expires_at, value))
+        if self._writer is not None:
+            self._writer.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._writer.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+        }
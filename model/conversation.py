@@ -0,0 +1,58 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def build_contents(prefix, prompt, history=()):
+    # A fresh list per request: the frozen few-shot prefix, the caller's own
+    # bounded conversation (if any) and finally the new prompt.
+    contents = list(prefix)
+    contents.extend(history)
+    contents.append({"role": "user", "parts": [prompt]})
+    return contents
+
+
+class SessionStore:
+    """Bounded per-client conversation histories with LRU and TTL eviction."""
+
+    def __init__(self, max_sessions=1000, ttl=1800, max_turns=10):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        if session_id is None:
+            return ()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return ()
+            expires_at, turns = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[session_id]
+                return ()
+            self._sessions.move_to_end(session_id)
+            return tuple(turns)
+
+    def append(self, session_id, prompt, reply):
+        if session_id is None:
+            return
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            turns = entry[1] if entry and entry[0] > time.monotonic() else []
+            turns.append({"role": "user", "parts": [prompt]})
+            turns.append({"role": "model", "parts": [reply]})
+            # Keep only the most recent user/model pairs
+            del turns[:max(len(turns) - 2 * self.max_turns, 0)]
+            self._sessions[session_id] = (time.monotonic() + self.ttl, turns)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
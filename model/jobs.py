@@ -0,0 +1,314 @@
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from cache import fingerprint
+from upstream import Overloaded
+
+_columns = "id, key, status, payload, result, error, created_at, finished_at"
+
+
+class Job:
+    __slots__ = ("id", "key", "status", "payload", "result", "error", "created_at", "finished_at", "done")
+
+    def __init__(self, id, key, payload, status="queued", result=None, error=None, created_at=None, finished_at=None):
+        self.id = id
+        self.key = key
+        self.payload = payload
+        self.status = status
+        self.result = result
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.finished_at = finished_at
+        self.done = asyncio.Event()
+        if status in ("done", "failed"):
+            self.done.set()
+
+    @classmethod
+    def from_row(cls, row):
+        id, key, status, payload, result, error, created_at, finished_at = row
+        return cls(id, key, json.loads(payload), status, json.loads(result), error, created_at, finished_at)
+
+    def describe(self):
+        return {"id": self.id, "status": self.status, "result": self.result, "error": self.error}
+
+
+class JobQueue:
+    """Runs submitted payloads on a bounded pool of workers.
+
+    Identical payloads that are still queued or running share one job, and
+    finished jobs are kept for polling until they expire or fall out of the
+    LRU. With a path, the SQLite table is the queue: every process polls it
+    and claims a job with a conditional UPDATE before running it, so a job
+    runs once however many workers share the file and any of them can report
+    on it. A running job's lease is renewed while it runs; one whose process
+    died is claimed again once the lease lapses."""
+
+    def __init__(self, run, workers=2, max_queued=100, max_finished=1000, ttl=3600, path=None, lease=60, poll=1.0):
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self.lease = lease
+        self.poll = poll
+        self.coalesced = 0
+        self._jobs = {}
+        self._pending = {}
+        self._finished = OrderedDict()
+        self._counts = {}
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            # Autocommit, so every statement (a claim in particular) is its own transaction
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, key TEXT, status TEXT, payload TEXT, "
+                "result TEXT, error TEXT, created_at REAL, finished_at REAL, heartbeat_at REAL)"
+            )
+            try:
+                # Tables from before leases
+                self._db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            except sqlite3.OperationalError:
+                pass
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    # SQLite access runs in a thread, one statement group at a time
+
+    async def _call(self, method, *args):
+        return await asyncio.to_thread(self._locked, method, *args)
+
+    def _locked(self, method, *args):
+        with self._lock:
+            return method(*args)
+
+    def _insert(self, job):
+        self._db.execute(
+            f"INSERT INTO jobs ({_columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.key, job.status, json.dumps(job.payload), json.dumps(job.result), job.error,
+             job.created_at, job.finished_at),
+        )
+
+    def _load(self, job_id):
+        row = self._db.execute(f"SELECT {_columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def _load_pending(self, key):
+        row = self._db.execute(
+            f"SELECT {_columns} FROM jobs WHERE key = ? AND status IN ('queued', 'running') "
+            "ORDER BY created_at LIMIT 1", (key,)
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def _count_queued(self):
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def _claim(self):
+        # Queued jobs, and running ones whose lease lapsed; the UPDATE only
+        # succeeds for the one process that still finds the job claimable
+        now = time.time()
+        claimable = "(status = 'queued' OR (status = 'running' AND heartbeat_at < ?))"
+        rows = self._db.execute(
+            f"SELECT {_columns} FROM jobs WHERE {claimable} ORDER BY created_at LIMIT 10", (now - self.lease,)
+        ).fetchall()
+        for row in rows:
+            claimed = self._db.execute(
+                f"UPDATE jobs SET status = 'running', heartbeat_at = ? WHERE id = ? AND {claimable}",
+                (now, row[0], now - self.lease),
+            ).rowcount
+            if claimed:
+                return Job.from_row(row)
+        return None
+
+    def _renew(self, job):
+        self._db.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'", (time.time(), job.id)
+        )
+
+    def _store(self, job):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (job.status, json.dumps(job.result), job.error, job.finished_at, job.id),
+        )
+        self._count()
+
+    def _release(self, job):
+        # Back in the queue straight away rather than when the lease lapses
+        self._db.execute("UPDATE jobs SET status = 'queued' WHERE id = ? AND status = 'running'", (job.id,))
+
+    def _count(self):
+        self._counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def _expire(self):
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND (finished_at <= ? OR id NOT IN "
+            "(SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY finished_at DESC LIMIT ?))",
+            (time.time() - self.ttl, self.max_finished),
+        )
+        self._count()
+
+    def _evict(self):
+        now = time.time()
+        while self._finished:
+            job = next(iter(self._finished.values()))
+            if len(self._finished) <= self.max_finished and job.finished_at + self.ttl > now:
+                break
+            self._jobs.pop(job.id, None)
+            self._finished.pop(job.id, None)
+
+    def start(self):
+        # Called from the lifespan hook, or lazily by the first submit
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload):
+        self.start()
+        key = fingerprint(json.dumps(payload, sort_keys=True))
+        if self._db is None:
+            job = self._pending.get(key)
+        else:
+            # Any process may have finished the job, so only the table says
+            # whether it is still pending. Two processes may still both accept
+            # the same payload at once; that only costs a duplicate run
+            job = await self._call(self._load_pending, key)
+        if job is not None:
+            self.coalesced += 1
+            return job
+        queued = self._queue.qsize() if self._db is None else await self._call(self._count_queued)
+        if queued >= self.max_queued:
+            raise Overloaded()
+        job = Job(uuid.uuid4().hex, key, payload)
+        if self._db is None:
+            self._jobs[job.id] = job
+            self._pending[key] = job
+            self._queue.put_nowait(job)
+        else:
+            await self._call(self._insert, job)
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id):
+        if self._db is not None:
+            # Whichever process runs the job, the table has its state
+            return await self._call(self._load, job_id)
+        self._evict()
+        job = self._jobs.get(job_id)
+        if job is not None and job.id in self._finished:
+            self._finished.move_to_end(job.id)
+        return job
+
+    async def wait(self, job, timeout):
+        if self._db is None:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return job
+        # Another process may be running it, so poll the table; a job running
+        # here also wakes the wait as soon as it finishes
+        deadline = time.monotonic() + timeout
+        while not job.done.is_set() and time.monotonic() < deadline:
+            local = self._jobs.get(job.id)
+            try:
+                await asyncio.wait_for(local.done.wait() if local else asyncio.sleep(self.poll),
+                                       min(self.poll, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            job = await self.get(job.id) or job
+        return job
+
+    async def _next(self):
+        if self._db is None:
+            return await self._queue.get()
+        while True:
+            self._wakeup.clear()
+            claimed = await self._call(self._claim)
+            if claimed is not None:
+                # With a table, _jobs only holds the jobs running here, so a
+                # wait in this process wakes as soon as one finishes
+                self._jobs[claimed.id] = claimed
+                return claimed
+            await self._call(self._expire)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _renew_lease(self, job):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await self._call(self._renew, job)
+
+    async def _requeue(self, job):
+        job.status = "queued"
+        if self._db is None:
+            self._queue.put_nowait(job)
+        else:
+            self._jobs.pop(job.id, None)
+            await self._call(self._release, job)
+
+    async def _worker(self):
+        while True:
+            job = await self._next()
+            job.status = "running"
+            lease = asyncio.create_task(self._renew_lease(job)) if self._db is not None else None
+            try:
+                job.result = await self.run(job.payload)
+                job.status = "done"
+            except Overloaded as exc:
+                # The upstream is shedding load (its circuit breaker is open):
+                # the job goes back in the queue and this worker backs off
+                await self._requeue(job)
+                await asyncio.sleep(exc.retry_after)
+                continue
+            except Exception as exc:
+                job.error = f"{type(exc).__name__}: {exc}"
+                job.status = "failed"
+            except asyncio.CancelledError:
+                # Shutting down: leave the job to the next worker to start
+                if self._db is not None:
+                    self._jobs.pop(job.id, None)
+                    await self._call(self._release, job)
+                raise
+            finally:
+                if lease is not None:
+                    lease.cancel()
+            job.finished_at = time.time()
+            if self._db is None:
+                self._pending.pop(job.key, None)
+                self._finished[job.id] = job
+                self._evict()
+            else:
+                await self._call(self._store, job)
+                self._jobs.pop(job.id, None)
+            job.done.set()
+
+    def stats(self):
+        if self._db is not None:
+            counts = self._counts
+        else:
+            statuses = [job.status for job in self._jobs.values()]
+            counts = {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "coalesced": self.coalesced,
+        }
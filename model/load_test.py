@@ -0,0 +1,69 @@
+import time
+import asyncio
+import argparse
+from upstream import ConcurrencyLimiter, Overloaded
+
+# Fake model with injected latency. generate_content blocks like the old
+# send_message path did, generate_content_async yields to the event loop.
+class FakeResponse:
+    text = "REMEMBER"
+
+class FakeModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, contents):
+        time.sleep(self.latency)
+        return FakeResponse()
+
+    async def generate_content_async(self, contents):
+        await asyncio.sleep(self.latency)
+        return FakeResponse()
+
+async def blocking_call(model, limiter):
+    return model.generate_content([])
+
+async def async_call(model, limiter):
+    async with limiter:
+        return await model.generate_content_async([])
+
+async def run(call, model, limiter, requests, concurrency):
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    rejected = 0
+
+    async def client():
+        nonlocal rejected
+        while not queue.empty():
+            queue.get_nowait()
+            try:
+                await call(model, limiter)
+            except Overloaded:
+                rejected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return (requests - rejected) / elapsed, rejected
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--max-queue", type=int, default=32)
+    args = parser.parse_args()
+
+    model = FakeModel(args.latency)
+    print(f"fake model latency {args.latency * 1000:.0f} ms, {args.requests} requests per run")
+    print(f"{'clients':>8} {'blocking req/s':>15} {'async req/s':>12} {'rejected':>9}")
+    for concurrency in (1, 2, 4, 8, 16, 32, 64, 128):
+        limiter = ConcurrencyLimiter(args.max_concurrency, args.max_queue)
+        blocking, _ = asyncio.run(run(blocking_call, model, limiter, min(args.requests, 40), concurrency))
+        limiter = ConcurrencyLimiter(args.max_concurrency, args.max_queue)
+        throughput, rejected = asyncio.run(run(async_call, model, limiter, args.requests, concurrency))
+        print(f"{concurrency:>8} {blocking:>15.1f} {throughput:>12.1f} {rejected:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import time
+import random
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+
+logger = logging.getLogger("bloomify.trace")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144)
+
+_registry = []
+_trace = ContextVar("trace", default=None)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), then sum and count
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {count}"
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+requests_total = Counter("bloomify_requests_total", "HTTP requests served", ("path", "status"))
+request_seconds = Histogram("bloomify_request_seconds", "HTTP request latency, up to the last body chunk", ("path",))
+requests_in_flight = Gauge("bloomify_requests_in_flight", "HTTP requests being served", ("path",))
+stage_seconds = Histogram("bloomify_stage_seconds", "Time spent per stage of a request", ("endpoint", "stage"))
+upstream_first_token_seconds = Histogram(
+    "bloomify_upstream_first_token_seconds", "Time to the first model output", ("endpoint",)
+)
+upstream_seconds = Histogram("bloomify_upstream_seconds", "Total model call time", ("endpoint",))
+upstream_errors_total = Counter("bloomify_upstream_errors_total", "Failed model calls", ("endpoint", "error"))
+upstream_retries_total = Counter("bloomify_upstream_retries_total", "Model calls retried after a retryable error", ("endpoint", "error"))
+upstream_blocked_total = Counter("bloomify_upstream_blocked_total", "Model calls stopped by safety filters", ("endpoint",))
+prompt_chars = Histogram("bloomify_prompt_chars", "Characters of contents sent to the model", ("endpoint",), SIZE_BUCKETS)
+response_chars = Histogram("bloomify_response_chars", "Characters of model output", ("endpoint",), SIZE_BUCKETS)
+tokens_total = Counter("bloomify_tokens_total", "Tokens reported by the model", ("endpoint", "kind"))
+upstream_queue = Gauge("bloomify_upstream_queue", "Model calls running and waiting for a slot", ("state",))
+component_stats = Gauge("bloomify_component", "Counters of the cache, classifier, question bank, jobs and upstream client", ("component", "stat"))
+
+
+def record_stage(endpoint, name, elapsed):
+    stage_seconds.observe(elapsed, endpoint, name)
+    trace = _trace.get()
+    if trace is not None:
+        trace["stages"].append((endpoint, name, round(elapsed * 1000, 3)))
+
+
+class stage:
+    # A plain class rather than @contextmanager, it sits on every hot path
+    __slots__ = ("endpoint", "name", "start")
+
+    def __init__(self, endpoint, name):
+        self.endpoint = endpoint
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.endpoint, self.name, time.perf_counter() - self.start)
+
+
+def record_usage(endpoint, response):
+    # usage_metadata is only filled in on the last chunk of a stream
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0)
+    response_tokens = getattr(usage, "candidates_token_count", 0)
+    if prompt_tokens:
+        tokens_total.inc(endpoint, "prompt", amount=prompt_tokens)
+    if response_tokens:
+        tokens_total.inc(endpoint, "response", amount=response_tokens)
+
+
+def start_trace(path, sample_rate):
+    if sample_rate and random.random() < sample_rate:
+        return _trace.set({"path": path, "stages": []})
+    return None
+
+
+def finish_trace(token, status, elapsed):
+    if token is None:
+        return
+    trace = _trace.get()
+    trace["status"] = status
+    trace["ms"] = round(elapsed * 1000, 3)
+    logger.info(json.dumps(trace))
+    _trace.reset(token)
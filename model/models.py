@@ -0,0 +1,46 @@
+import os
+from functools import lru_cache
+from prompts import system_instructions
+
+model_name = "gemini-1.0-pro"
+
+generation_config = {
+    "temperature": 0.9,
+    "top_p": 1,
+    "top_k": 1,
+    "max_output_tokens": 2048,
+}
+
+safety_settings = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+ENDPOINTS = ("classify", "suggest", "generate")
+
+# Gemini 1.0 has no system instruction; with it the instruction is sent as
+# the opening turn of every request instead (see prompt_builder.prefix)
+system_instruction_supported = not model_name.startswith("gemini-1.0")
+
+
+@lru_cache(maxsize=None)
+def configure():
+    # The SDK is imported here, not at module level, so importing the service
+    # (gunicorn master, tests, tooling) never pays for it or needs an API key
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return genai
+
+
+@lru_cache(maxsize=None)
+def get_model(endpoint):
+    # One client per endpoint, built on first use and reused afterwards
+    genai = configure()
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        safety_settings=safety_settings,
+        system_instruction=system_instructions[endpoint] if system_instruction_supported else None,
+    )
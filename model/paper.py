@@ -0,0 +1,195 @@
+import re
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from bloom import BLOOM_LEVELS, parse_level
+
+TABLE_HEADER = (
+    "| Unit | Question | Marks | Sub-question | Marks (per sub-question) | Taxonomy Level | Question Type |\n"
+    "|------|----------|-------|--------------|--------------------------|----------------|---------------|\n"
+)
+
+_sub_number = re.compile(r"^\**\s*(\d+(?:\.\d+)*)[\.\)]?\s+(.*)$")
+_integer = re.compile(r"\d+")
+_unit_label = re.compile(r"unit\W*(\d+)", re.IGNORECASE)
+_pipe = re.compile(r"(?<!\\)\|")
+
+
+class SubQuestion(BaseModel):
+    number: str
+    text: str
+    marks: int
+    level: Optional[str] = None
+    type: str = ""
+
+class Question(BaseModel):
+    label: str
+    marks: int
+    optional: bool = False
+    sub_questions: List[SubQuestion] = []
+
+class Unit(BaseModel):
+    unit: int
+    questions: List[Question] = []
+    marks: int = 0
+    bloom_score: float = 0.0
+
+class Paper(BaseModel):
+    university: str
+    degree: str
+    year: str
+    branch: str
+    subject: str
+    units: List[Unit]
+    total_marks: int
+    bloom_score: float
+    marks_per_level: Dict[str, int]
+    # What is still wrong with units that ran out of regeneration attempts
+    validation_errors: List[str] = []
+
+
+def _marks(cell):
+    match = _integer.search(cell)
+    return int(match.group()) if match else None
+
+def _cells(line):
+    line = line.strip().strip("|")
+    if "\\|" in line:
+        cells = [cell.strip().replace("\\|", "|") for cell in _pipe.split(line)]
+    else:
+        cells = [cell.strip() for cell in line.split("|")]
+    if len(cells) > 7:
+        # An unescaped pipe inside the question text; the outer columns are fixed
+        cells = cells[:3] + ["|".join(cells[3:-3])] + cells[-3:]
+    return cells + [""] * (7 - len(cells))
+
+def parse_paper(text):
+    # Parse a paper table into units. A "Unit N" cell opens a new unit, rows
+    # that continue a sub-question (MCQ options and the like) are folded into
+    # the previous sub-question, and anything that is not a table row is ignored.
+    units = []
+    unit = question = None
+    for line in (text or "").splitlines():
+        if not line.lstrip().startswith("|"):
+            continue
+        unit_cell, label, marks, sub, sub_marks, level, kind = _cells(line)
+        if not (sub + marks + label).strip("-: ") or sub.startswith(("Sub-question", "sub-question")):
+            continue
+        match = _unit_label.search(unit_cell)
+        if match:
+            unit = Unit(unit=int(match.group(1)))
+            units.append(unit)
+            question = None
+        label = label.strip("* ")
+        if "question" in label.lower():
+            if unit is None:
+                unit = Unit(unit=1)
+                units.append(unit)
+            question = Question(label=label, marks=_marks(marks) or 0, optional="optional" in label.lower())
+            unit.questions.append(question)
+        if question is None:
+            continue
+        sub_marks = _marks(sub_marks)
+        match = _sub_number.match(sub)
+        if sub_marks is None or not match:
+            if question.sub_questions and sub:
+                question.sub_questions[-1].text += " " + sub
+            continue
+        question.sub_questions.append(SubQuestion(
+            number=match.group(1),
+            text=match.group(2),
+            marks=sub_marks,
+            level=parse_level(level),
+            type=kind,
+        ))
+    return units
+
+def parse_unit(text, unit):
+    # Every row belongs to the requested unit, whatever the model labelled it
+    parsed = Unit(unit=unit)
+    for part in parse_paper(text):
+        parsed.questions.extend(part.questions)
+    return parsed
+
+
+def bloom_score(sub_questions):
+    # Marks-weighted average of the Bloom levels, REMEMBER = 1 ... CREATE = 6
+    total = sum(sub.marks for sub in sub_questions if sub.level)
+    if not total:
+        return 0.0
+    return sum(
+        (BLOOM_LEVELS.index(sub.level) + 1) * sub.marks for sub in sub_questions if sub.level
+    ) / total
+
+def validate_unit(unit, scheme, average_blooms_score, tolerance):
+    errors = []
+    expected = 2 * scheme.main_questions_per_unit
+    if len(unit.questions) != expected:
+        errors.append(f"unit {unit.unit}: expected {expected} questions, got {len(unit.questions)}")
+    sub_questions = []
+    for question in unit.questions:
+        subs = question.sub_questions
+        sub_questions.extend(subs)
+        if len(subs) != scheme.sub_questions_per_main_question:
+            errors.append(f"unit {unit.unit} {question.label}: expected "
+                          f"{scheme.sub_questions_per_main_question} sub-questions, got {len(subs)}")
+        total = sum(sub.marks for sub in subs)
+        if total != scheme.marks_per_main_question:
+            errors.append(f"unit {unit.unit} {question.label}: sub-question marks sum to {total}, "
+                          f"expected {scheme.marks_per_main_question}")
+        if any(sub.level is None for sub in subs):
+            errors.append(f"unit {unit.unit} {question.label}: missing Bloom level")
+    score = bloom_score(sub_questions)
+    if abs(score - average_blooms_score) > tolerance:
+        errors.append(f"unit {unit.unit}: Bloom score {score:.2f}, expected {average_blooms_score}")
+    return errors
+
+
+def build_paper(units, university, degree, year, branch, subject):
+    # Totals count main questions only; optional questions are alternatives.
+    # Bloom scores cover every sub-question a student might attempt.
+    marks_per_level = {level: 0 for level in BLOOM_LEVELS}
+    sub_questions = []
+    for unit in units:
+        unit_subs = [sub for question in unit.questions for sub in question.sub_questions]
+        unit.marks = sum(question.marks for question in unit.questions if not question.optional)
+        unit.bloom_score = round(bloom_score(unit_subs), 2)
+        sub_questions.extend(unit_subs)
+        for sub in unit_subs:
+            if sub.level:
+                marks_per_level[sub.level] += sub.marks
+    return Paper(
+        university=university,
+        degree=degree,
+        year=year,
+        branch=branch,
+        subject=subject,
+        units=units,
+        total_marks=sum(unit.marks for unit in units),
+        bloom_score=round(bloom_score(sub_questions), 2),
+        marks_per_level=marks_per_level,
+    )
+
+
+def render_rows(units):
+    lines = []
+    for unit in units:
+        unit_label = f"Unit {unit.unit}"
+        for question in unit.questions:
+            question_label, marks = question.label, str(question.marks)
+            for sub in question.sub_questions:
+                level = sub.level.capitalize() if sub.level else ""
+                text = sub.text.replace("|", "\\|")
+                lines.append(f"| {unit_label} | {question_label} | {marks} | {sub.number} {text} "
+                             f"| {sub.marks} | {level} | {sub.type} |\n")
+                unit_label = question_label = marks = ""
+    return "".join(lines)
+
+def render_paper(units, university, degree, year, branch, subject):
+    return (
+        f"**{university} - {degree}**\n"
+        f"**{year} - {branch}**\n"
+        f"**Subject - {subject}**\n"
+        "\n"
+        + TABLE_HEADER
+        + render_rows(units)
+    )
@@ -0,0 +1,194 @@
+import re
+from prompts import *
+from cache import normalize
+from models import system_instruction_supported
+from paper import TABLE_HEADER, Question, SubQuestion, Unit, render_rows
+from upstream import estimate_tokens
+
+# Sub-questions the generation example is cut from, cycled to the requested shape
+EXAMPLE_SUB_QUESTIONS = (
+    ("Which of the following is NOT a type of neural network architecture? a) Feedforward Network "
+     "b) Convolutional Neural Network c) Recurrent Neural Network d) Binary Search Tree", "REMEMBER", "MCQ"),
+    ("Describe the topology of neural network architecture.", "UNDERSTAND", "Descriptive"),
+    ("Calculate the dot product of vectors `a = [1, 2, 3]` and `b = [4, 5, 6]`.", "APPLY", "Numerical"),
+    ("Compare and contrast BNN and ANN.", "ANALYZE", "Descriptive"),
+    ("Write a Python function to calculate the dot product of two vectors.", "APPLY", "Coding"),
+    ("Prove that the dot product of two orthogonal vectors is zero.", "EVALUATE", "Numerical"),
+    ("Explain the basic learning laws in neural networks.", "UNDERSTAND", "Descriptive"),
+    ("Design a perceptron that separates two given classes of points.", "CREATE", "Descriptive"),
+)
+
+# A question and its optional question show the shape; the counts are in the prompt
+EXAMPLE_QUESTIONS = 1
+
+_topic_split = re.compile(r"[,;\n]|[.:](?=\s|$)")
+
+
+def compact(text):
+    return " ".join(text.split())
+
+
+def truncate(text, tokens):
+    # Cut at a word boundary so the estimate stays within tokens
+    limit = max(1, tokens - 1) * 4
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+def summarize_syllabus(content, tokens):
+    # Extractive: drop repeated topics, then keep an evenly spaced subset so
+    # the whole unit stays represented rather than just its opening topics
+    content = compact(content)
+    limit = max(1, tokens - 1) * 4
+    if len(content) <= limit:
+        return content
+    topics = []
+    seen = set()
+    for topic in _topic_split.split(content):
+        topic = topic.strip()
+        if topic and normalize(topic) not in seen:
+            seen.add(normalize(topic))
+            topics.append(topic)
+    best = None
+    low, high = 1, len(topics)
+    while low <= high:
+        keep = (low + high) // 2
+        text = ", ".join(topics[i * len(topics) // keep] for i in range(keep))
+        if len(text) <= limit:
+            best, low = text, keep + 1
+        else:
+            high = keep - 1
+    return best if best is not None else truncate(topics[0] if topics else content, tokens)
+
+
+def render_syllabus(syllabus, tokens=None):
+    # "Unit 1: ..." lines, each unit summarised into an equal share of tokens
+    share = max(2, tokens // len(syllabus)) if tokens is not None and syllabus else None
+    return "\n".join(
+        f"Unit {unit.unit}: {summarize_syllabus(unit.content, share) if share else compact(unit.content)}"
+        for unit in syllabus
+    )
+
+
+def example_unit(scheme, unit):
+    size = scheme.sub_questions_per_main_question
+    base, extra = divmod(scheme.marks_per_main_question, size)
+    questions = []
+    for slot in range(2 * min(scheme.main_questions_per_unit, EXAMPLE_QUESTIONS)):
+        number, optional = slot // 2 + 1, slot % 2 == 1
+        first = size * optional + 1
+        sub_questions = []
+        for i in range(size):
+            text, level, kind = EXAMPLE_SUB_QUESTIONS[(slot * size + i) % len(EXAMPLE_SUB_QUESTIONS)]
+            # The remainder goes to the last sub-questions so the marks add up
+            marks = base + (i >= size - extra)
+            sub_questions.append(SubQuestion(number=f"{number}.{first + i}", text=text, marks=marks,
+                                             level=level, type=kind))
+        questions.append(Question(
+            label=f"Optional Question {number}" if optional else f"Question {number}",
+            marks=scheme.marks_per_main_question,
+            optional=optional,
+            sub_questions=sub_questions,
+        ))
+    return Unit(unit=unit, questions=questions)
+
+
+def render_example(scheme, unit):
+    return TABLE_HEADER + render_rows([example_unit(scheme, unit)])
+
+
+def prefix(endpoint, history=()):
+    # Without system instruction support the instruction opens the conversation
+    if system_instruction_supported:
+        return tuple(history)
+    return (
+        {"role": "user", "parts": [system_instructions[endpoint]]},
+        {"role": "model", "parts": ["Understood."]},
+    ) + tuple(history)
+
+
+def _fits(prompt, budget):
+    return budget is None or estimate_tokens(len(prompt)) <= budget
+
+
+def build_classify_prompt(question, budget=None):
+    question = compact(question)
+    return classification_prompt.format(truncate(question, budget) if budget else question)
+
+
+def build_batch_classify_prompt(questions, budget=None):
+    # Budget is per question here, the batch size bounds the rest
+    return batch_classification_prompt.format("\n".join(
+        f"{i}. {truncate(compact(question), budget) if budget else compact(question)}"
+        for i, question in enumerate(questions, 1)
+    ))
+
+
+def build_suggest_prompt(question, level, related=(), budget=None):
+    question = compact(question)
+    related = list(related)
+
+    def render():
+        grounding = suggestion_grounding.format("\n".join(f"- {text}" for text in related)) if related else ""
+        return suggestion_prompt.format(question, level, grounding)
+
+    # Grounding is the first thing to go, the question itself the last
+    while related and not _fits(render(), budget):
+        related.pop()
+    if not _fits(render(), budget):
+        question = truncate(question, budget - estimate_tokens(len(render()) - len(question)))
+    return render()
+
+
+def build_unit_prompt(input, syllabus, avoid=(), budget=None):
+    scheme = input.marking_scheme
+    fields = dict(
+        university=input.university,
+        degree=input.degree,
+        year=input.year,
+        branch=input.branch,
+        subject=input.subject,
+        unit=syllabus.unit,
+        main_questions_per_unit=scheme.main_questions_per_unit,
+        marks_per_main_question=scheme.marks_per_main_question,
+        sub_questions_per_main_question=scheme.sub_questions_per_main_question,
+        average_blooms_score=input.average_blooms_score,
+        example=render_example(scheme, syllabus.unit),
+    )
+    content = compact(syllabus.content)
+    avoid = list(avoid)
+
+    def render():
+        block = unit_generation_avoid.format("\n".join(f"- {text}" for text in avoid)) if avoid else ""
+        return unit_generation_prompt.format(content=content, avoid=block, **fields)
+
+    # Past questions to avoid go first (least similar first), then the
+    # syllabus is summarised into whatever is left
+    while avoid and not _fits(render(), budget):
+        avoid.pop()
+    if not _fits(render(), budget):
+        content = summarize_syllabus(content, budget - estimate_tokens(len(render()) - len(content)))
+    return render()
+
+
+def build_generation_prompt(input, budget=None):
+    scheme = input.marking_scheme
+    fields = dict(
+        university=input.university,
+        degree=input.degree,
+        year=input.year,
+        branch=input.branch,
+        subject=input.subject,
+        total_marks=scheme.marks_per_unit * len(input.syllabus),
+        main_questions_per_unit=scheme.main_questions_per_unit,
+        marks_per_main_question=scheme.marks_per_main_question,
+        sub_questions_per_main_question=scheme.sub_questions_per_main_question,
+        average_blooms_score=input.average_blooms_score,
+        example=render_example(scheme, 1),
+    )
+    prompt = generation_prompt.format(syllabus=render_syllabus(input.syllabus), **fields)
+    if _fits(prompt, budget):
+        return prompt
+    spare = budget - estimate_tokens(len(generation_prompt.format(syllabus="", **fields)))
+    return generation_prompt.format(syllabus=render_syllabus(input.syllabus, spare), **fields)
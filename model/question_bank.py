@@ -0,0 +1,226 @@
+import re
+import time
+import zlib
+import random
+import sqlite3
+import threading
+from collections import deque
+from itertools import combinations
+import numpy as np
+from bloom import BLOOM_LEVELS
+from cache import BackgroundWriter, normalize
+from paper import Question, SubQuestion, Unit
+
+_word = re.compile(r"\w+")
+
+
+def embed(text, dimensions):
+    # Hashed bag of unigrams and bigrams, L2 normalised so a dot product is
+    # the cosine similarity
+    words = _word.findall(normalize(text))
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for gram in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+        vector[zlib.crc32(gram.encode()) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def near_duplicates(texts, others, dimensions=1024, similarity=0.92):
+    # The texts that nearly repeat one of others, by the bank's own measure
+    if not others:
+        return []
+    matrix = np.stack([embed(text, dimensions) for text in others])
+    return [text for text in texts if (matrix @ embed(text, dimensions)).max() >= similarity]
+
+
+class QuestionBank:
+    """Generated and classified questions with a cosine similarity index.
+
+    Everything is held in memory, up to max_entries; past that each new entry
+    takes the place of the oldest classified question, or of the oldest
+    generated one once no classified questions are left. With a path, entries
+    are also written to SQLite (in the background) and the newest max_entries
+    are reloaded (and re-embedded) on start."""
+
+    def __init__(self, path=None, dimensions=1024, duplicate_similarity=0.92, syllabus_similarity=0.8,
+                 max_entries=5000):
+        self.dimensions = dimensions
+        self.duplicate_similarity = duplicate_similarity
+        self.syllabus_similarity = syllabus_similarity
+        self.max_entries = max_entries
+        self.entries = []
+        self.filled = 0
+        self.missed = 0
+        self.evicted = 0
+        size = min(64, max_entries)
+        self._vectors = np.zeros((size, dimensions), dtype=np.float32)
+        self._syllabi = np.zeros((size, dimensions), dtype=np.float32)
+        # Per-slot level, subject and marks, so searches filter with masks
+        self._levels = np.zeros(size, dtype=np.int8)
+        self._subjects = np.zeros(size, dtype=np.int32)
+        self._marks = np.zeros(size, dtype=np.int32)
+        self._subject_ids = {}
+        self._texts = {}
+        # Slots in insertion order, classified questions apart from generated ones
+        self._classified = deque()
+        self._generated = deque()
+        self._lock = threading.Lock()
+        self._writer = None
+        if path:
+            db = sqlite3.connect(path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS questions (id INTEGER PRIMARY KEY, text TEXT, subject TEXT, unit INTEGER, "
+                "syllabus TEXT, level TEXT, marks INTEGER, type TEXT, created_at REAL)"
+            )
+            db.commit()
+            rows = db.execute(
+                "SELECT text, subject, unit, syllabus, level, marks, type FROM questions ORDER BY id DESC LIMIT ?",
+                (max_entries,),
+            ).fetchall()
+            db.close()
+            for row in reversed(rows):
+                self._insert(dict(zip(("text", "subject", "unit", "syllabus", "level", "marks", "type"), row)))
+            self._writer = BackgroundWriter(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _subject_id(self, subject_key):
+        return self._subject_ids.setdefault(subject_key, len(self._subject_ids) + 1)
+
+    def _insert(self, entry):
+        # Returns the entry whose slot it took, if the bank was full
+        evicted = None
+        if len(self.entries) < self.max_entries:
+            index = len(self.entries)
+            if index == len(self._vectors):
+                size = min(2 * index, self.max_entries)
+                for name in ("_vectors", "_syllabi", "_levels", "_subjects", "_marks"):
+                    array = getattr(self, name)
+                    grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+                    grown[:index] = array
+                    setattr(self, name, grown)
+            self.entries.append(entry)
+        else:
+            index = (self._classified or self._generated).popleft()
+            evicted = self.entries[index]
+            del self._texts[normalize(evicted["text"])]
+            self.entries[index] = entry
+            self.evicted += 1
+        self._vectors[index] = embed(entry["text"], self.dimensions)
+        self._syllabi[index] = embed(entry["syllabus"], self.dimensions)
+        entry["subject_key"] = normalize(entry["subject"])
+        self._levels[index] = BLOOM_LEVELS.index(entry["level"]) + 1 if entry["level"] in BLOOM_LEVELS else 0
+        self._subjects[index] = self._subject_id(entry["subject_key"])
+        self._marks[index] = entry["marks"] or 0
+        self._texts[normalize(entry["text"])] = index
+        (self._generated if entry["marks"] else self._classified).append(index)
+        return evicted
+
+    def add(self, text, level, subject="", unit=0, syllabus="", marks=0, type=""):
+        # Repeats and near duplicates of an existing question are dropped;
+        # returns whether it was stored
+        if normalize(text) in self._texts:
+            return False
+        vector = embed(text, self.dimensions)
+        with self._lock:
+            count = len(self.entries)
+            if normalize(text) in self._texts or (
+                    count and (self._vectors[:count] @ vector).max() >= self.duplicate_similarity):
+                return False
+            entry = {"text": text, "subject": subject, "unit": unit, "syllabus": syllabus,
+                     "level": level, "marks": marks, "type": type}
+            evicted = self._insert(entry)
+        if self._writer is not None:
+            if evicted is not None:
+                self._writer.execute("DELETE FROM questions WHERE text = ?", (evicted["text"],))
+            self._writer.execute(
+                "INSERT INTO questions (text, subject, unit, syllabus, level, marks, type, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (text, subject, unit, syllabus, level, marks, type, time.time()),
+            )
+        return True
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def add_unit(self, unit, subject, syllabus):
+        for question in unit.questions:
+            for sub in question.sub_questions:
+                if sub.level:
+                    self.add(sub.text, sub.level, subject, unit.unit, syllabus, sub.marks, sub.type)
+
+    def search(self, text, k=5, level=None, subject=None, min_similarity=0.0):
+        vector = embed(text, self.dimensions)
+        with self._lock:
+            count = len(self.entries)
+            if not count:
+                return []
+            scores = self._vectors[:count] @ vector
+            keep = scores >= min_similarity
+            if level is not None:
+                keep &= self._levels[:count] == (BLOOM_LEVELS.index(level) + 1 if level in BLOOM_LEVELS else -1)
+            if subject is not None:
+                keep &= self._subjects[:count] == self._subject_ids.get(normalize(subject), -1)
+            indices = np.flatnonzero(keep)
+            if len(indices) > k:
+                indices = indices[np.argpartition(-scores[indices], k)[:k]]
+            indices = indices[np.argsort(-scores[indices], kind="stable")]
+            return [(self.entries[index], float(scores[index])) for index in indices]
+
+    def _candidates(self, subject, syllabus):
+        # Sub-questions with marks that were set for the same subject and an
+        # (almost) identical unit syllabus
+        count = len(self.entries)
+        subject_id = self._subject_ids.get(normalize(subject))
+        if not count or subject_id is None:
+            return []
+        scores = self._syllabi[:count] @ embed(syllabus, self.dimensions)
+        keep = (self._marks[:count] > 0) & (self._subjects[:count] == subject_id) & (scores >= self.syllabus_similarity)
+        return [self.entries[index] for index in np.flatnonzero(keep)]
+
+    def fill_unit(self, unit, subject, syllabus, scheme, average_blooms_score, limit=12):
+        # Build a whole unit from banked sub-questions. Each question slot takes
+        # the combination of unused sub-questions whose marks add up exactly and
+        # whose Bloom score is closest to the target. None if any slot is short.
+        with self._lock:
+            candidates = self._candidates(subject, syllabus)
+        random.shuffle(candidates)
+        size = scheme.sub_questions_per_main_question
+        used = set()
+        questions = []
+        for slot in range(2 * scheme.main_questions_per_unit):
+            pool = [entry for entry in candidates if id(entry) not in used][:limit]
+            best, best_distance = None, None
+            for combination in combinations(pool, size):
+                marks = sum(entry["marks"] for entry in combination)
+                if marks != scheme.marks_per_main_question:
+                    continue
+                score = sum((BLOOM_LEVELS.index(entry["level"]) + 1) * entry["marks"] for entry in combination) / marks
+                distance = abs(score - average_blooms_score)
+                if best is None or distance < best_distance:
+                    best, best_distance = combination, distance
+            if best is None:
+                self.missed += 1
+                return None
+            used.update(id(entry) for entry in best)
+            number, optional = slot // 2 + 1, slot % 2 == 1
+            first = size * optional + 1
+            questions.append(Question(
+                label=f"Optional Question {number}" if optional else f"Question {number}",
+                marks=scheme.marks_per_main_question,
+                optional=optional,
+                sub_questions=[
+                    SubQuestion(number=f"{number}.{first + i}", text=entry["text"], marks=entry["marks"],
+                                level=entry["level"], type=entry["type"])
+                    for i, entry in enumerate(best)
+                ],
+            ))
+        self.filled += 1
+        return Unit(unit=unit, questions=questions)
+
+    def stats(self):
+        return {"size": len(self.entries), "evicted": self.evicted, "units_filled": self.filled,
+                "units_missed": self.missed}
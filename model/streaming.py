@@ -0,0 +1,48 @@
+async def iter_rows(chunks):
+    # Regroup arbitrary text chunks into whole lines, so every markdown table
+    # row reaches the client as one unit
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        end = buffer.rfind("\n")
+        if end != -1:
+            yield buffer[:end + 1]
+            buffer = buffer[end + 1:]
+    if buffer:
+        yield buffer
+
+
+async def prepend(first, rest):
+    if first:
+        yield first
+    async for item in rest:
+        yield item
+
+
+# Finish reasons of an answer the model completed; SAFETY, RECITATION and the
+# like stop it partway, MAX_TOKENS cuts it off at the output limit
+_finished = ("FINISH_REASON_UNSPECIFIED", "STOP")
+
+# Closes a stream that ended early, since its 200 has already been sent
+stopped_marker = "\n**Error: the model stopped early ({}), this paper is incomplete.**\n"
+
+
+class StoppedEarly(ValueError):
+    """Raised when the model stopped before producing any output."""
+
+    def __init__(self, reason):
+        super().__init__(f"model stopped early: {reason}")
+        self.reason = reason
+
+
+def stop_reason(response):
+    # Why the model stopped short, or None. No candidates at all means the
+    # prompt itself was blocked
+    candidates = getattr(response, "candidates", None)
+    if candidates is None:
+        return None
+    if not candidates:
+        reason = getattr(getattr(response, "prompt_feedback", None), "block_reason", None)
+        return getattr(reason, "name", None) or "BLOCKED"
+    reason = getattr(candidates[0].finish_reason, "name", None)
+    return reason if reason and reason not in _finished else None
@@ -0,0 +1,26 @@
+from bloom import parse_level, parse_numbered_levels
+
+
+def test_parse_level_takes_the_first_level_named():
+    assert parse_level("Level: analyse") == "ANALYZE"
+    assert parse_level("No level here") is None
+
+
+def test_numbered_levels_in_the_requested_form():
+    text = "1. REMEMBER\n2) apply\n3: **Evaluate**\n4 - Synthesis.\n"
+    assert parse_numbered_levels(text, 4) == ["REMEMBER", "APPLY", "EVALUATE", "CREATE"]
+
+
+def test_numbered_lines_with_more_than_a_level_are_unparsed():
+    text = (
+        "1. Create a CNN for MNIST - ANALYZE\n"
+        "2. UNDERSTAND\n"
+        "3. Evaluate the design -> UNDERSTAND\n"
+        "4. APPLY, because it uses a formula\n"
+    )
+    assert parse_numbered_levels(text, 4) == [None, "UNDERSTAND", None, None]
+
+
+def test_numbered_levels_ignore_out_of_range_and_repeated_items():
+    text = "Here you go:\n2. APPLY\n2. CREATE\n7. REMEMBER\n"
+    assert parse_numbered_levels(text, 3) == [None, "APPLY", None]
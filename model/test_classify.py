@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+import app
+from test_generate import FakeModel, answer_with, client
+
+
+class StoppedModel(FakeModel):
+    # Answers with partial text from a candidate the filters stopped
+    async def generate_content_async(self, contents):
+        self.calls += 1
+        stopped = SimpleNamespace(finish_reason=SimpleNamespace(name="SAFETY"))
+        return SimpleNamespace(text=self.text, candidates=[stopped])
+
+
+def test_classify_caches_only_answers_naming_a_level(monkeypatch, client):
+    model = answer_with(monkeypatch, "I cannot tell without more context.")
+    question = {"question": "Discuss the trade-offs of a hypothetical scheduler."}
+    for _ in range(2):
+        assert client.post("/classify/", json=question).text == "I cannot tell without more context."
+    assert model.calls == 2
+    model.text = "EVALUATE"
+    for _ in range(2):
+        assert client.post("/classify/", json=question).text == "EVALUATE"
+    assert model.calls == 3
+
+
+def test_suggest_does_not_cache_answers_the_model_stopped_short(monkeypatch, client):
+    model = StoppedModel("Design a")
+    monkeypatch.setattr(app, "get_model", lambda endpoint: model)
+    suggestion = {"question": "What is a heap in data structures?", "desired_level": "CREATE"}
+    for _ in range(2):
+        client.post("/suggest/", json=suggestion)
+    assert model.calls == 2
+    finished = answer_with(monkeypatch, "Design a priority queue for a hospital triage system.")
+    for _ in range(2):
+        client.post("/suggest/", json=suggestion)
+    assert finished.calls == 1
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+import pytest
+from fastapi.testclient import TestClient
+import app
+from paper import Unit, render_rows
+from test_paper import question
+
+
+class FakeModel:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, contents):
+        self.calls += 1
+        return SimpleNamespace(text=self.text)
+
+
+@pytest.fixture
+def client():
+    return TestClient(app.app)
+
+
+def answer_with(monkeypatch, text):
+    model = FakeModel(text)
+    monkeypatch.setattr(app, "get_model", lambda endpoint: model)
+    return model
+
+
+def payload(marks_per_main_question=10):
+    return {
+        "syllabus": [{"unit": 1, "content": "Paging and segmentation"}],
+        "marking_scheme": {
+            "marks_per_unit": 10,
+            "main_questions_per_unit": 1,
+            "sub_questions_per_main_question": 2,
+            "marks_per_main_question": marks_per_main_question,
+        },
+        "university": "University",
+        "degree": "B.Tech",
+        "branch": "CSE",
+        "year": "Year 3",
+        "subject": "Operating Systems",
+        "average_blooms_score": 2,
+        "use_question_bank": False,
+    }
+
+
+def unit_table():
+    return render_rows([Unit(unit=1, questions=[question(1), question(1, optional=True)])])
+
+
+def test_unit_with_no_readable_questions_is_a_502(monkeypatch, client):
+    model = answer_with(monkeypatch, (
+        "| Unit 1 | Q1 | 10 | (a) Explain paging. | 4 | Understand | Descriptive |\n"
+        "|        |    |    | (b) Compare paging and segmentation. | 6 | Analyze | Descriptive |\n"
+    ))
+    response = client.post("/generate/", json=payload())
+    assert response.status_code == 502
+    assert model.calls == app.generate_unit_attempts
+
+
+def test_unit_that_never_validates_is_sent_with_its_errors(monkeypatch, client):
+    answer_with(monkeypatch, unit_table())
+    response = client.post("/generate/", json=payload(marks_per_main_question=12))
+    assert response.status_code == 200
+    assert "Sub-question 1.1" in response.text
+    assert "expected 12" in response.headers["X-Validation-Errors"]
+
+    paper = client.post("/generate/json", json=payload(marks_per_main_question=12)).json()
+    assert [len(unit["questions"]) for unit in paper["units"]] == [2]
+    assert any("expected 12" in error for error in paper["validation_errors"])
+
+
+def test_valid_unit_has_no_validation_errors(monkeypatch, client):
+    answer_with(monkeypatch, unit_table())
+    response = client.post("/generate/", json=payload())
+    assert response.status_code == 200
+    assert "X-Validation-Errors" not in response.headers
+    assert client.post("/generate/json", json=payload()).json()["validation_errors"] == []
+
+
+@pytest.mark.parametrize("field", ["main_questions_per_unit", "sub_questions_per_main_question", "marks_per_main_question"])
+def test_zero_in_the_marking_scheme_is_rejected(monkeypatch, client, field):
+    model = answer_with(monkeypatch, unit_table())
+    body = payload()
+    body["marking_scheme"][field] = 0
+    assert client.post("/generate/", json=body).status_code == 422
+    assert model.calls == 0
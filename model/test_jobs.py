@@ -0,0 +1,125 @@
+import asyncio
+import time
+from jobs import JobQueue
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Runner:
+    # Stands in for run_generation_job; release lets queued jobs finish
+    def __init__(self):
+        self.payloads = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, payload):
+        await self.release.wait()
+        self.payloads.append(payload)
+        return {"echo": payload}
+
+
+async def finished(queue, job):
+    job = await queue.wait(job, 5)
+    assert job.status == "done"
+    return job
+
+
+def test_identical_pending_payloads_share_a_job():
+    async def main():
+        runner = Runner()
+        queue = JobQueue(runner, workers=1)
+        first = await queue.submit({"n": 1})
+        second = await queue.submit({"n": 1})
+        other = await queue.submit({"n": 2})
+        assert first is second and other is not first
+        runner.release.set()
+        assert (await finished(queue, first)).result == {"echo": {"n": 1}}
+        await finished(queue, other)
+        assert runner.payloads == [{"n": 1}, {"n": 2}]
+        # Once finished, the same payload runs again
+        assert await queue.submit({"n": 1}) is not first
+        assert queue.coalesced == 1
+        await queue.stop()
+
+    run(main())
+
+
+def test_finished_jobs_fall_out_of_the_lru():
+    async def main():
+        runner = Runner()
+        runner.release.set()
+        queue = JobQueue(runner, workers=1, max_finished=1)
+        first = await finished(queue, await queue.submit({"n": 1}))
+        second = await finished(queue, await queue.submit({"n": 2}))
+        assert await queue.get(first.id) is None
+        assert (await queue.get(second.id)).status == "done"
+        await queue.stop()
+
+    run(main())
+
+
+def test_processes_sharing_a_file_see_each_others_jobs(tmp_path):
+    async def main():
+        path = str(tmp_path / "jobs.db")
+        runner = Runner()
+        runner.release.set()
+        # The accepting process has no workers, so the other one runs the job
+        accepting = JobQueue(runner, workers=0, path=path, poll=0.05)
+        running = JobQueue(runner, workers=1, path=path, poll=0.05)
+        accepting.start()
+        job = await accepting.submit({"n": 1})
+        assert (await accepting.submit({"n": 1})).id == job.id
+        assert (await running.submit({"n": 1})).id == job.id
+        running.start()
+        job = await finished(accepting, job)
+        assert job.result == {"echo": {"n": 1}}
+        assert runner.payloads == [{"n": 1}]
+        # The finished job is not pending anywhere, so the payload runs again
+        # instead of coalescing onto the old result
+        again = await accepting.submit({"n": 1})
+        assert again.id != job.id
+        await finished(accepting, again)
+        assert runner.payloads == [{"n": 1}, {"n": 1}]
+        assert accepting._jobs == {} and accepting._pending == {}
+        await asyncio.gather(accepting.stop(), running.stop())
+
+    run(main())
+
+
+def test_finished_jobs_expire_from_the_table(tmp_path):
+    async def main():
+        runner = Runner()
+        runner.release.set()
+        queue = JobQueue(runner, workers=1, ttl=0, path=str(tmp_path / "jobs.db"), poll=0.05)
+        job = await queue.submit({"n": 1})
+        for _ in range(50):
+            if runner.payloads and await queue.get(job.id) is None:
+                break
+            await asyncio.sleep(0.05)
+        assert runner.payloads == [{"n": 1}]
+        assert await queue.get(job.id) is None
+        await queue.stop()
+
+    run(main())
+
+
+def test_job_of_a_dead_process_is_claimed_once_its_lease_lapses(tmp_path):
+    async def main():
+        path = str(tmp_path / "jobs.db")
+        runner = Runner()
+        runner.release.set()
+        dead = JobQueue(runner, workers=0, path=path, lease=0.3, poll=0.05)
+        dead.start()
+        job = await dead.submit({"n": 1})
+        # Claimed and then never renewed, as if its process had died
+        assert dead._locked(dead._claim).id == job.id
+        alive = JobQueue(runner, workers=1, path=path, lease=0.3, poll=0.05)
+        alive.start()
+        started = time.monotonic()
+        job = await finished(alive, job)
+        assert time.monotonic() - started >= 0.25
+        assert runner.payloads == [{"n": 1}]
+        await asyncio.gather(dead.stop(), alive.stop())
+
+    run(main())
@@ -0,0 +1,67 @@
+import os
+from paper import Question, SubQuestion, Unit, parse_paper, parse_unit, render_paper, render_rows
+
+EXAMPLE_PAPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "example_paper.md")
+
+
+def question(number, optional=False, marks=(4, 6), texts=None, levels=("REMEMBER", "APPLY")):
+    first = len(marks) * optional + 1
+    texts = texts or [f"Sub-question {number}.{first + i}" for i in range(len(marks))]
+    return Question(
+        label=f"Optional Question {number}" if optional else f"Question {number}",
+        marks=sum(marks),
+        optional=optional,
+        sub_questions=[
+            SubQuestion(number=f"{number}.{first + i}", text=text, marks=mark, level=level, type="Descriptive")
+            for i, (text, mark, level) in enumerate(zip(texts, marks, levels))
+        ],
+    )
+
+
+def sample_units():
+    return [
+        Unit(unit=1, questions=[question(1), question(1, optional=True)]),
+        Unit(unit=2, questions=[
+            question(1, texts=["Explain paging.", "Compute `a | b` for a = 5 and b = 3."]),
+            question(1, optional=True, levels=("ANALYZE", "CREATE")),
+            question(2, marks=(2, 3, 5), levels=("UNDERSTAND", "EVALUATE", "APPLY")),
+            question(2, optional=True, marks=(2, 3, 5), levels=("UNDERSTAND", "EVALUATE", "APPLY")),
+        ]),
+    ]
+
+
+def test_rendered_rows_parse_back_to_the_same_units():
+    units = sample_units()
+    assert parse_paper(render_rows(units)) == units
+
+
+def test_rendered_paper_parses_back_ignoring_its_title_lines():
+    units = sample_units()
+    text = render_paper(units, "University", "B.Tech", "Year 3", "CSE", "Operating Systems")
+    assert parse_paper(text) == units
+
+
+def test_parse_unit_puts_every_row_in_the_requested_unit():
+    units = sample_units()
+    parsed = parse_unit(render_rows(units), 7)
+    assert parsed.unit == 7
+    assert parsed.questions == [question for unit in units for question in unit.questions]
+
+
+def test_continuation_rows_fold_into_the_previous_sub_question():
+    text = (
+        "| Unit 1 | Question 1 | 5 | 1.1 Which of these is a sorting algorithm? | 5 | Remember | MCQ |\n"
+        "|        |            |   | a) Quicksort b) Dijkstra | | | |\n"
+        "|        |            |   | c) Prim d) Kruskal | | | |\n"
+    )
+    [unit] = parse_paper(text)
+    [sub] = unit.questions[0].sub_questions
+    assert sub.text == "Which of these is a sorting algorithm? a) Quicksort b) Dijkstra c) Prim d) Kruskal"
+    assert (sub.marks, sub.level, sub.type) == (5, "REMEMBER", "MCQ")
+
+
+def test_example_paper_round_trips():
+    with open(EXAMPLE_PAPER_PATH, encoding="utf-8") as file:
+        units = parse_paper(file.read())
+    assert units and all(unit.questions for unit in units)
+    assert parse_paper(render_rows(units)) == units
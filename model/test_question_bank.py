@@ -0,0 +1,48 @@
+from question_bank import QuestionBank
+
+
+def test_search_filters_by_level_and_subject():
+    bank = QuestionBank()
+    bank.add("Explain paging in operating systems.", "UNDERSTAND", subject="Operating Systems")
+    bank.add("Compare paging with segmentation.", "ANALYZE", subject="Operating Systems")
+    bank.add("Explain paging of search results in web apps.", "UNDERSTAND", subject="Web Development")
+    results = bank.search("Explain paging", k=5, level="UNDERSTAND", subject="operating systems")
+    assert [entry["text"] for entry, _ in results] == ["Explain paging in operating systems."]
+    assert bank.search("Explain paging", level="CREATE") == []
+    scores = [score for _, score in bank.search("Explain paging", k=3)]
+    assert scores == sorted(scores, reverse=True) and len(scores) == 3
+
+
+def test_repeats_are_not_stored_twice():
+    bank = QuestionBank()
+    assert bank.add("What is a deadlock?", "REMEMBER")
+    assert not bank.add("what is a  deadlock?", "REMEMBER")
+    assert len(bank) == 1
+
+
+def test_full_bank_evicts_classified_questions_before_generated_ones():
+    bank = QuestionBank(max_entries=3)
+    bank.add("Define a process.", "REMEMBER", subject="OS", marks=5)
+    bank.add("What is a thread?", "REMEMBER")
+    bank.add("What is a semaphore?", "REMEMBER")
+    bank.add("Design a scheduler for real-time tasks.", "CREATE", subject="OS", marks=10)
+    bank.add("Evaluate round robin scheduling.", "EVALUATE")
+    texts = {entry["text"] for entry in bank.entries}
+    assert texts == {"Define a process.", "Design a scheduler for real-time tasks.", "Evaluate round robin scheduling."}
+    assert bank.stats()["evicted"] == 2
+    # Once only generated questions are left, the oldest of them goes
+    bank.add("Implement a ring buffer.", "APPLY", subject="OS", marks=5)
+    bank.add("Analyze the cost of context switches.", "ANALYZE", subject="OS", marks=5)
+    assert "Define a process." not in {entry["text"] for entry in bank.entries}
+    assert len(bank) == 3
+    assert [entry["text"] for entry, _ in bank.search("What is a thread?", min_similarity=0.9)] == []
+
+
+def test_reload_keeps_the_newest_entries(tmp_path):
+    path = str(tmp_path / "bank.db")
+    bank = QuestionBank(path=path, max_entries=2)
+    for text in ("What is paging?", "What is a TLB?", "What is thrashing?"):
+        bank.add(text, "REMEMBER")
+    bank.flush()
+    reloaded = QuestionBank(path=path, max_entries=2)
+    assert {entry["text"] for entry in reloaded.entries} == {"What is a TLB?", "What is thrashing?"}
@@ -0,0 +1,243 @@
+import asyncio
+import pytest
+import upstream
+from upstream import CircuitBreaker, CircuitOpen, ConcurrencyLimiter, Overloaded, UpstreamClient, wait_for_slot
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def settle_loop():
+    # Let callbacks and woken tasks run
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_limiter_grants_up_to_max_concurrency_then_queues():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=2, max_queue=4)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        assert (limiter.in_flight, limiter.waiting) == (2, 1)
+        limiter.release()
+        await waiter
+        assert (limiter.in_flight, limiter.waiting) == (2, 0)
+        limiter.release()
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    run(main())
+
+
+def test_limiter_sheds_when_queue_is_full():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        with pytest.raises(Overloaded):
+            await limiter.acquire(wait=False)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    run(main())
+
+
+def test_cancelled_waiter_gives_back_its_queue_place():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert (limiter.in_flight, limiter.waiting) == (1, 0)
+        # The place is free again and the cancelled waiter is never granted
+        second = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        limiter.release()
+        await second
+        assert (limiter.in_flight, limiter.waiting) == (1, 0)
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    run(main())
+
+
+def test_waiter_cancelled_after_grant_releases_its_slot():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        # The release grants the waiter, which is cancelled before it resumes
+        limiter.release()
+        assert limiter.in_flight == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert (limiter.in_flight, limiter.waiting) == (0, 0)
+
+    run(main())
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=10)
+        await limiter.acquire()
+        order = []
+
+        async def call(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        tasks = [asyncio.create_task(call(name, priority))
+                 for name, priority in (("generate", 2), ("suggest", 1), ("classify", 0), ("classify 2", 0))]
+        await settle_loop()
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["classify", "classify 2", "suggest", "generate"]
+
+    run(main())
+
+
+def test_background_waiters_are_not_shed_and_do_not_fill_the_queue():
+    async def main():
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        await limiter.acquire()
+
+        async def background():
+            wait_for_slot.set(True)
+            await limiter.acquire()
+            limiter.release()
+
+        tasks = [asyncio.create_task(background()) for _ in range(3)]
+        await settle_loop()
+        assert (limiter.waiting, limiter.waiting_background) == (3, 3)
+        foreground = asyncio.create_task(limiter.acquire())
+        await settle_loop()
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        limiter.release()
+        await asyncio.gather(*tasks, foreground)
+        limiter.release()
+        assert (limiter.in_flight, limiter.waiting, limiter.waiting_background) == (0, 0, 0)
+
+    run(main())
+
+
+def test_settle_charges_the_real_usage_of_clamped_prompts():
+    async def main():
+        limiter = ConcurrencyLimiter(tokens_per_minute=6000)
+        capacity = limiter.tokens.capacity
+        await limiter.acquire(tokens=5000)
+        limiter.release()
+        limiter.settle(5000, 5200)
+        assert limiter.tokens.level == pytest.approx(capacity - 5200, abs=1)
+
+    run(main())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, reset_after=30)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == "closed"
+    breaker.failure()
+    assert (breaker.state, breaker.trips) == ("open", 1)
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.check()
+    assert raised.value.retry_after == 30
+
+
+def test_breaker_lets_one_probe_through_after_reset(clock):
+    breaker = CircuitBreaker(failures=1, reset_after=30)
+    breaker.failure()
+    clock.now += 31
+    breaker.check()
+    assert breaker.state == "half_open"
+    # Only the probe goes through
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_breaker_reopens_when_the_probe_fails(clock):
+    breaker = CircuitBreaker(failures=1, reset_after=30)
+    breaker.failure()
+    clock.now += 31
+    breaker.check()
+    breaker.failure()
+    assert (breaker.state, breaker.trips) == ("open", 1)
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    clock.now += 31
+    breaker.check()
+    assert breaker.state == "half_open"
+
+
+def test_breaker_abandoned_probe_allows_another(clock):
+    breaker = CircuitBreaker(failures=1, reset_after=30)
+    breaker.failure()
+    clock.now += 31
+    breaker.check()
+    breaker.abandon()
+    assert breaker.state == "open"
+    breaker.check()
+    assert breaker.state == "half_open"
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def test_client_retries_retryable_errors_only():
+    async def main():
+        client = UpstreamClient(ConcurrencyLimiter(), CircuitBreaker(failures=10), retries=3, backoff=0)
+        outcomes = [UpstreamError(429), UpstreamError(503), "ok"]
+
+        async def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        assert await client.call("classify", flaky) == "ok"
+        assert client.retried == 2
+
+        async def refused():
+            raise UpstreamError(400)
+
+        with pytest.raises(UpstreamError):
+            await client.call("classify", refused)
+        assert client.retried == 2
+        assert client.limiter.in_flight == 0
+
+    run(main())
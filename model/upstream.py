@@ -0,0 +1,336 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import metrics
+
+# HTTP statuses worth another attempt: quota, timeouts and server errors
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class Overloaded(Exception):
+    """Raised when the upstream queue is full and the request should be shed."""
+
+    def __init__(self, retry_after=1):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Overloaded):
+    """Raised without calling the model while the circuit breaker is open."""
+
+
+# Set by background work such as generation jobs: their calls wait for a slot
+# however long the queue is, rather than being shed like an HTTP request
+wait_for_slot = ContextVar("wait_for_slot", default=False)
+
+
+def retryable(exc):
+    # google.api_core errors carry the HTTP status in .code, so the SDK does
+    # not have to be imported to recognise a 429
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        return int(getattr(exc, "code", 0) or 0) in RETRYABLE_STATUS
+    except (TypeError, ValueError):
+        return False
+
+
+def estimate_tokens(chars):
+    # Roughly four characters per token for English prompts
+    return chars // 4 + 1
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 a second up to burst."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60
+        # Burst plus a minute of refill is what one minute can use, so by
+        # default only a second's worth is banked
+        self.capacity = burst or max(1, per_minute / 60)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        # Seconds until amount is available
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent model calls and rejects callers once the wait queue is full.
+
+    With requests_per_minute or tokens_per_minute, calls also wait for quota.
+    Waiters are served by priority (lower first), then in arrival order, so a
+    queue of long /generate/ calls cannot hold back /classify/. Callers in a
+    wait_for_slot context are never rejected and do not count towards
+    max_queue."""
+
+    def __init__(self, max_concurrency=8, max_queue=32, requests_per_minute=0, tokens_per_minute=0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.waiting_background = 0
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._waiters = []
+        self._order = itertools.count()
+        self._timer = None
+
+    def _delay(self, tokens):
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.delay(1)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens))
+        return delay
+
+    def _grant(self, tokens):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        self.in_flight += 1
+
+    def _dispatch(self):
+        while self._waiters and self.in_flight < self.max_concurrency:
+            _, _, tokens, future, background = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._delay(tokens)
+            if delay > 0:
+                # Out of quota: look again once the head of the queue fits
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                return
+            heapq.heappop(self._waiters)
+            self.waiting -= 1
+            self.waiting_background -= background
+            self._grant(tokens)
+            future.set_result(None)
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    def charge(self, tokens):
+        # What acquire takes from the token bucket for an estimate: a prompt
+        # bigger than the bucket would otherwise never fit
+        if self.tokens is not None:
+            return min(tokens, self.tokens.capacity)
+        return tokens
+
+    async def acquire(self, priority=0, tokens=0, wait=True):
+        tokens = self.charge(tokens)
+        if not self.waiting and self.in_flight < self.max_concurrency and not self._delay(tokens):
+            self._grant(tokens)
+            return
+        background = wait_for_slot.get()
+        if not wait or (not background and self.waiting - self.waiting_background >= self.max_queue):
+            raise Overloaded()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), tokens, future, background))
+        self.waiting += 1
+        self.waiting_background += background
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.waiting -= 1
+                self.waiting_background -= background
+            else:
+                # Granted just as the caller went away
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def settle(self, estimated, actual):
+        # Charge the difference once the model reports the real token count,
+        # against what acquire actually took for the estimate
+        if self.tokens is not None and actual:
+            self.tokens.take(actual - self.charge(estimated))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class CircuitBreaker:
+    """Opens after consecutive retryable failures and fails fast for reset_after
+    seconds, then lets a single probe through to decide whether to close."""
+
+    def __init__(self, failures=5, reset_after=30):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_after - time.monotonic()
+        if remaining > 0 or self.probing:
+            raise CircuitOpen(max(1, round(remaining)))
+        self.probing = True
+
+    def success(self):
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.consecutive += 1
+        if self.probing or (self.opened_at is None and self.consecutive >= self.failures):
+            if not self.probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def abandon(self):
+        # A probe that was cancelled says nothing about the upstream
+        self.probing = False
+
+
+class UpstreamClient:
+    """Runs model calls through the limiter with retries, hedging and a breaker.
+
+    attempt is a coroutine function making one request; it is called again
+    after a retryable failure (with full-jitter exponential backoff), and with
+    hedge=True a duplicate is started if the first has not answered within
+    hedge_after seconds, provided there is spare capacity for it."""
+
+    def __init__(self, limiter, breaker, retries=3, backoff=0.5, max_backoff=8.0, hedge_after=0.0):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def _attempt(self, endpoint, attempt, priority, tokens, wait=True, hold=False):
+        queued = time.perf_counter()
+        await self.limiter.acquire(priority, tokens, wait)
+        metrics.record_stage(endpoint, "queue", time.perf_counter() - queued)
+        try:
+            result = await attempt()
+        except BaseException:
+            self.limiter.release()
+            raise
+        if not hold:
+            self.limiter.release()
+        return result
+
+    async def _hedged(self, endpoint, attempt, priority, tokens):
+        first = asyncio.ensure_future(self._attempt(endpoint, attempt, priority, tokens))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(self._attempt(endpoint, attempt, priority, tokens, wait=False))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both failed, or the hedge found no spare capacity: report the original
+            raise first.exception()
+        finally:
+            if not (second.done() and not second.cancelled() and isinstance(second.exception(), Overloaded)):
+                self.hedged += 1
+            for task in (first, second):
+                task.cancel()
+
+    async def call(self, endpoint, attempt, priority=0, tokens=0, hedge=False, hold=False):
+        for number in range(self.retries + 1):
+            self.breaker.check()
+            try:
+                if hedge and self.hedge_after and not hold:
+                    result = await self._hedged(endpoint, attempt, priority, tokens)
+                else:
+                    result = await self._attempt(endpoint, attempt, priority, tokens, hold=hold)
+            except Overloaded:
+                self.breaker.abandon()
+                raise
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as exc:
+                if not retryable(exc):
+                    # The upstream answered, the request itself was refused
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if number == self.retries:
+                    raise
+                self.retried += 1
+                metrics.upstream_retries_total.inc(endpoint, type(exc).__name__)
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** number)))
+                continue
+            self.breaker.success()
+            return result
+
+    @asynccontextmanager
+    async def stream(self, endpoint, attempt, priority=0, tokens=0):
+        # attempt opens the stream; the slot is held until the caller is done
+        # reading it, and only opening the stream is retried
+        result = await self.call(endpoint, attempt, priority, tokens, hold=True)
+        try:
+            yield result
+        finally:
+            self.limiter.release()
+
+    def settle(self, tokens, response):
+        usage = getattr(response, "usage_metadata", None)
+        self.limiter.settle(tokens, getattr(usage, "total_token_count", 0))
+
+    def stats(self):
+        stats = {
+            "retries": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "circuit_open": int(self.breaker.opened_at is not None),
+            "circuit_trips": self.breaker.trips,
+        }
+        if self.limiter.requests is not None:
+            stats["requests_available"] = self.limiter.requests.level
+        if self.limiter.tokens is not None:
+            stats["tokens_available"] = self.limiter.tokens.level
+        return stats